@@ -35,3 +35,91 @@ CHUNK_SIMILARITY_THRESHOLD = 0.25  # Balanced threshold for better retrieval cov
 ENABLE_CACHING = True  # Enable response and embedding caching
 CACHE_SIZE_LIMIT = 1000  # Maximum cache entries
 CACHE_TTL_HOURS = 24  # Cache time-to-live in hours
+
+# Embedding batching - pack many chunks per request and run batches concurrently
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 1536))  # 1536 is native; 512/256 truncate (Matryoshka)
+EMBEDDING_BATCH_MAX_ITEMS = 256  # OpenAI accepts up to 2048 inputs per request
+EMBEDDING_BATCH_MAX_TOKENS = 100_000  # Estimated input tokens per request (API cap is 300k)
+EMBEDDING_MAX_CONCURRENCY = 4  # Embedding requests in flight per embed_texts call
+
+# Persistent embedding cache - content-addressed vectors on local disk
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_CACHE_SIZE_LIMIT = CACHE_SIZE_LIMIT * 100  # Vectors, not documents: one policy PDF is ~1-2k chunks
+
+# Document cache - parsed text, chunks and retriever per ingested document
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # Render free plan has 512MB RAM
+DOCUMENT_CACHE_REVALIDATE_SECS = 300  # Reuse a URL without re-downloading for this long
+
+# Pooled HTTP clients - shared for the app lifetime with keep-alive
+BLOB_MAX_CONNECTIONS = 20  # Document downloads
+OPENAI_MAX_CONNECTIONS = 50  # Embeddings and chat completions
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY_SECS = 60
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"  # Needs the h2 package
+
+# Document download limits - large bodies are streamed to a temp file instead of RAM
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", 100 * 1024 * 1024))
+DOWNLOAD_SPOOL_THRESHOLD_BYTES = 8 * 1024 * 1024  # Smaller bodies stay in memory
+
+# Parallel PDF parsing - large PDFs are split into page ranges across processes
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = 64  # Below this a single thread is faster than process hand-off
+PDF_PAGES_PER_RANGE = 32
+
+# Pipelined ingestion - parse, chunk and embed PDFs concurrently with bounded queues
+PIPELINE_ENABLED = True
+PIPELINE_PAGE_QUEUE_SIZE = 16  # Parsed pages waiting for the chunker
+
+# Answer cache - full-content keys, LRU+TTL in memory with an optional SQLite tier
+ANSWER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+ANSWER_CACHE_DB_PATH = os.getenv("ANSWER_CACHE_DB_PATH", ".cache/answers.sqlite3")  # Empty disables the disk tier
+
+# Batched answering - questions with overlapping context share one chat completion
+LLM_BATCHING_ENABLED = True
+LLM_BATCH_MAX_QUESTIONS = 4
+LLM_BATCH_MIN_OVERLAP = 0.5  # Jaccard overlap of retrieved chunk sets needed to share a call
+CONTEXT_TOKEN_BUDGET = 4000  # Document context tokens per prompt, counted with tiktoken when installed
+
+# OpenAI scheduler - shared RPM/TPM budgets, AIMD concurrency and fair queuing per request
+OPENAI_CHAT_RPM = int(os.getenv("OPENAI_CHAT_RPM", 500))
+OPENAI_CHAT_TPM = int(os.getenv("OPENAI_CHAT_TPM", 30_000))
+OPENAI_EMBEDDING_RPM = int(os.getenv("OPENAI_EMBEDDING_RPM", 3_000))
+OPENAI_EMBEDDING_TPM = int(os.getenv("OPENAI_EMBEDDING_TPM", 1_000_000))
+OPENAI_MAX_CONCURRENCY = 16  # Upper bound the AIMD limit can grow to
+OPENAI_TARGET_LATENCY_SECS = 20.0  # Slower responses shrink the concurrency limit
+
+# Embedding retries - per batch, honouring Retry-After, within one overall deadline
+EMBEDDING_MAX_ATTEMPTS = 4
+EMBEDDING_DEADLINE_SECS = 120  # Total budget for one embed_texts call, retries included
+
+# Retriever storage - "float32", or "float16"/"int8" codes searched first and re-scored exactly
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+RESCORE_CANDIDATES_PER_HIT = 4  # Quantized candidates re-scored per requested hit
+RESCORE_MIN_CANDIDATES = 32
+
+# Hybrid retrieval - BM25 over chunk text fused with dense scores by reciprocal rank
+HYBRID_RETRIEVAL_ENABLED = True
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # Rank offset in 1 / (RRF_K + rank)
+HYBRID_CANDIDATES_PER_HIT = 3  # Each retriever contributes up to this many x top_k candidates
+
+# Approximate search - IVF index (numpy, or FAISS IndexIVFFlat) for documents with many chunks
+ANN_MIN_CHUNKS = 50_000  # Below this exact search is fast enough and IVF recall@k drops under 0.95
+ANN_LISTS = 0  # k-means lists; 0 picks 2 * sqrt(chunks)
+ANN_NPROBE = 16  # Lists scanned per query; recall@k >= 0.97 from ANN_MIN_CHUNKS in benchmarks/bench_ann.py
+
+# Document snapshots - ingested documents persisted on disk and memory-mapped back
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", ".cache/snapshots")  # Empty disables snapshots
+SNAPSHOT_MAX_DOCUMENTS = 100  # Oldest snapshots beyond this are deleted; 0 disables pruning
+SNAPSHOT_WARM_URLS = [u.strip() for u in os.getenv("SNAPSHOT_WARM_URLS", "").split(",") if u.strip()]  # Loaded at startup
+
+# Boilerplate removal - repeated headers/footers and duplicate chunks are dropped before embedding
+DEDUP_ENABLED = True
+BOILERPLATE_SAMPLE_PAGES = 12  # Leading pages scanned for paragraphs that recur page after page
+BOILERPLATE_MIN_PAGE_FRACTION = 0.5  # Share of sampled pages a paragraph must appear on
+BOILERPLATE_MIN_PAGES = 3
+NEAR_DUPLICATE_THRESHOLD = 0.9  # Estimated Jaccard similarity of word 3-grams
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # LSH bands of MINHASH_PERMUTATIONS / MINHASH_BANDS rows each
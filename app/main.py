@@ -1,7 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from .routers.hackrx import router as hackrx_router
+from .services.http_clients import open_clients, close_clients
+from .services.document_ingestion import shutdown_parse_pool
+from .services.document_cache import warm_snapshots
+from .services.embedding_cache import flush_embedding_stores
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled keep-alive clients live for the whole app instead of one per call
+    await open_clients()
+    # Known policies come back from disk snapshots instead of being re-embedded after a cold start
+    await warm_snapshots()
+    try:
+        yield
+    finally:
+        await close_clients()
+        shutdown_parse_pool()
+        flush_embedding_stores()
+
 
-app = FastAPI(title="HackRX Intelligent Query Retrieval")
+app = FastAPI(title="HackRX Intelligent Query Retrieval", lifespan=lifespan)
 
 app.include_router(hackrx_router, prefix="/api/v1")
 
@@ -1,11 +1,46 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 
 class RunRequest(BaseModel):
     documents: str = Field(..., description="Blob URL to a document (PDF/DOCX/Email)")
     questions: List[str] = Field(..., description="List of user questions")
+    traceable: bool = Field(False, description="Also return source references and policy identifiers per answer")
+
+
+class SourceReference(BaseModel):
+    chunk_id: str
+    rank: int = Field(..., description="1-based position among the chunks retrieved for the question")
+    rank_score: Optional[float] = Field(None, description=(
+        "Score the chunks were ordered by: the reciprocal-rank fusion sum of the dense and BM25 rankings "
+        "(at most about 0.033) with hybrid retrieval, otherwise the cosine similarity"))
+    similarity: Optional[float] = Field(None, description="Cosine similarity of question and chunk embeddings; "
+                                        "null when the question was answered from BM25 alone")
+    bm25: Optional[float] = Field(None, description="BM25 score of the chunk for the question; null without hybrid retrieval")
+    policy_section: str
+
+
+class PolicyIdentifiers(BaseModel):
+    irdai_reg_no: List[str] = []
+    cin: List[str] = []
+    uin: List[str] = []
+    policy_name: List[str] = []
+
+
+class TraceableAnswer(BaseModel):
+    answer: str
+    source_references: List[SourceReference]
+    confidence_score: float
+    policy_identifiers: PolicyIdentifiers
 
 
 class RunResponse(BaseModel):
     answers: List[str]
+    traceability: Optional[List[TraceableAnswer]] = None  # Only when the request sets `traceable`
+
+
+class StreamedAnswer(BaseModel):
+    index: int = Field(..., description="Position of the question in the request")
+    answer: str
+    error: Optional[str] = Field(None, description="Set, with an empty answer, when answering this question failed")
+    traceability: Optional[TraceableAnswer] = None  # Only when the request sets `traceable`
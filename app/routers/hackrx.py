@@ -1,83 +1,198 @@
 from __future__ import annotations
 import asyncio
-from typing import List
+import logging
+from typing import Dict, List, Optional, Set, Tuple
 
+import numpy as np
 from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import StreamingResponse
 
 from ..config import (
     REQUIRED_BEARER_TOKEN,
-    DEFAULT_CHUNK_WORDS,
-    DEFAULT_CHUNK_OVERLAP_WORDS,
     TOP_K,
+    LLM_BATCHING_ENABLED,
 )
-from ..models.schemas import RunRequest, RunResponse
-from ..services.document_ingestion import ingest_document
-from ..utils.chunking import build_chunks
-from ..services.embeddings import embed_texts, embed_query
-from ..services.retrieval import Retriever, Chunk
-from ..services.llm import answer_with_openai, answer_with_openai_traceable
+from ..models.schemas import RunRequest, RunResponse, StreamedAnswer
+from ..services.answer_cache import answer_cache
+from ..services.document_cache import IngestedDocument, document_cache, get_document, DocumentError
+from ..services.document_ingestion import DocumentTooLargeError
+from ..services.embeddings import embed_queries
+from ..services.retrieval import Chunk, Retriever
+from ..services.llm import answer_group_with_openai, group_questions, recent_calls, token_usage
+from ..services.openai_scheduler import new_flow, scheduler_stats
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
-@router.post("/hackrx/run", response_model=RunResponse)
-async def run_endpoint(
-    payload: RunRequest,
-    authorization: str = Header(default=""),
-):
+NOT_FOUND_ANSWER = "Information not found in the document."
+
+
+def _authorize(authorization: str) -> None:
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
     if authorization.split(" ", 1)[1] != REQUIRED_BEARER_TOKEN:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    # OPTIMIZED: Process document ingestion and chunking
-    full_text = await ingest_document(payload.documents)
-    if not full_text:
-        raise HTTPException(status_code=400, detail="Failed to parse document")
-
-    chunk_tuples = build_chunks(full_text, DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS)
-    if not chunk_tuples:
-        raise HTTPException(status_code=400, detail="No content after parsing")
-
-    chunks: List[Chunk] = [Chunk(id=cid, text=ct) for (ct, cid) in chunk_tuples]
-    chunk_texts: List[str] = [c.text for c in chunks]
-
-    # OPTIMIZED: Generate embeddings for all chunks at once
-    chunk_embeddings = await embed_texts(chunk_texts)
-    retriever = Retriever(chunk_embeddings, chunks)
-
-    # ENHANCED: Process all questions with improved retrieval and traceability
-    async def process_question(q: str) -> str:
-        q_vec = await embed_query(q)
-        top_chunks = retriever.search(q_vec, TOP_K)
-        
-        # IMPROVED: Better context formatting with chunk relevance scores
-        if not top_chunks:
-            return "Information not found in the document."
-        
-        # Filter out low-quality chunks and format context
-        relevant_chunks = []
-        chunk_texts_for_trace = []
-        for chunk, score in top_chunks:
-            if score > 0.25:  # Using optimized threshold from config
-                relevant_chunks.append(f"[Chunk {chunk.id} - Score: {score:.2f}] {chunk.text}")
-                chunk_texts_for_trace.append(chunk.text)
-        
-        if not relevant_chunks:
-            return "Information not found in the document."
-        
-        # Use traceable response for enhanced information
-        traceable_response = await answer_with_openai_traceable(chunk_texts_for_trace, q)
-        return traceable_response["answer"]  # Keep backward compatibility
-
-    # OPTIMIZED: Process questions concurrently with controlled parallelism
-    semaphore = asyncio.Semaphore(3)  # Limit concurrent LLM calls
-    
-    async def process_with_semaphore(q: str) -> str:
-        async with semaphore:
-            return await process_question(q)
-    
-    # Process all questions concurrently
-    answers = await asyncio.gather(*[process_with_semaphore(q) for q in payload.questions])
-
-    return RunResponse(answers=list(answers))
+
+async def _load_document(url: str) -> IngestedDocument:
+    # OPTIMIZED: Ingest, chunk and embed the document once; repeat URLs come from the document cache
+    try:
+        document = await get_document(url)
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except DocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return document
+
+
+async def _plan_answers(questions: List[str], retriever: Retriever, explain: bool = False
+                        ) -> Tuple[List[List[Chunk]], List[List[Dict[str, Optional[float]]]], List[List[int]]]:
+    """Per-question retrieved chunks (best first) and their scores, plus the groups of answerable
+    questions to send to the LLM.
+
+    A chunk's scores hold the `rank_score` it was ordered by; with `explain` also its cosine
+    `similarity` to the question and its `bm25` score, for traceability.
+    """
+    # OPTIMIZED: Questions naming an identifier found in the document are answered from BM25
+    # alone; the rest are embedded in a single request and everything is scored in one pass
+    question_vectors = np.zeros((len(questions), retriever.embeddings.shape[1]), dtype=np.float32)
+    needs_vector = [i for i, q in enumerate(questions) if not retriever.matches_identifier(q)]
+    if needs_vector:
+        question_vectors[needs_vector] = await embed_queries([questions[i] for i in needs_vector])
+    hit_indices, hit_scores = retriever.hybrid_search_batch(questions, question_vectors, TOP_K)
+    similarity, bm25 = (retriever.score_hits(questions, question_vectors, hit_indices) if explain
+                        else (None, None))
+
+    def optional(scores: Optional[np.ndarray], row: int, col: int) -> Optional[float]:
+        if scores is None or np.isnan(scores[row, col]):
+            return None
+        return float(scores[row, col])
+
+    # ENHANCED: Collect each question's relevant context for improved answers and traceability
+    def select_context(row: int) -> Tuple[List[Chunk], List[Dict[str, Optional[float]]], Set[int]]:
+        # Low-quality chunks are already -1 (below the similarity threshold with no term match);
+        # the LLM layer merges overlapping chunks and packs them into its token budget
+        chunks_for_trace: List[Chunk] = []
+        chunk_scores: List[Dict[str, Optional[float]]] = []
+        chunk_ids: Set[int] = set()
+        for col, idx in enumerate(hit_indices[row]):
+            if idx >= 0:
+                chunks_for_trace.append(retriever.chunks[idx])
+                chunk_scores.append({"rank_score": float(hit_scores[row, col]),
+                                     "similarity": optional(similarity, row, col), "bm25": optional(bm25, row, col)})
+                chunk_ids.add(int(idx))
+        return chunks_for_trace, chunk_scores, chunk_ids
+
+    selected = [select_context(i) for i in range(len(questions))]
+    answerable = [i for i, (chunks, _, _) in enumerate(selected) if chunks]
+
+    # OPTIMIZED: Questions retrieving mostly the same chunks share one LLM call
+    if LLM_BATCHING_ENABLED:
+        groups = [[answerable[j] for j in g] for g in group_questions([selected[i][2] for i in answerable])]
+    else:
+        groups = [[i] for i in answerable]
+    return [chunks for chunks, _, _ in selected], [scores for _, scores, _ in selected], groups
+
+
+async def _answer_group(questions: List[str], contexts: List[List[Chunk]], group: List[int]) -> List[Tuple[int, str]]:
+    answers = await answer_group_with_openai([contexts[i] for i in group], [questions[i] for i in group])
+    return list(zip(group, answers))
+
+
+@router.post("/hackrx/run", response_model=RunResponse, response_model_exclude_none=True)
+async def run_endpoint(
+    payload: RunRequest,
+    authorization: str = Header(default=""),
+):
+    _authorize(authorization)
+    # OpenAI calls made for this request queue fairly against other requests' calls
+    new_flow()
+    document = await _load_document(payload.documents)
+    contexts, scores, groups = await _plan_answers(payload.questions, document.retriever, payload.traceable)
+
+    # OPTIMIZED: Process questions concurrently; the shared OpenAI scheduler controls parallelism
+    answers: List[str] = [NOT_FOUND_ANSWER] * len(payload.questions)
+    for results in await asyncio.gather(*[_answer_group(payload.questions, contexts, g) for g in groups]):
+        for i, answer in results:
+            answers[i] = answer
+
+    if not payload.traceable:
+        return RunResponse(answers=answers)
+    # ENHANCED: Traceability is looked up in the document's metadata index built at ingestion
+    return RunResponse(answers=answers, traceability=[
+        document.metadata.trace(answers[i], contexts[i], scores[i]) for i in range(len(answers))
+    ])
+
+
+@router.post("/hackrx/run/stream")
+async def run_stream_endpoint(
+    payload: RunRequest,
+    authorization: str = Header(default=""),
+    accept: str = Header(default=""),
+):
+    """Same as /hackrx/run, but streams {index, answer} records as each answer completes.
+
+    NDJSON by default; Server-Sent Events when the client accepts text/event-stream.
+    Document errors still surface as HTTP errors because ingestion finishes before streaming starts;
+    a failed LLM call yields {index, answer: "", error} records for its questions only.
+    With `traceable` set, each answered record also carries its traceability.
+    """
+    _authorize(authorization)
+    new_flow()
+    document = await _load_document(payload.documents)
+    contexts, scores, groups = await _plan_answers(payload.questions, document.retriever, payload.traceable)
+    use_sse = "text/event-stream" in accept
+
+    def encode(index: int, answer: str, error: Optional[str] = None) -> str:
+        trace = None
+        if payload.traceable and error is None:
+            trace = document.metadata.trace(answer, contexts[index], scores[index])
+        record = StreamedAnswer(index=index, answer=answer, error=error,
+                                traceability=trace).model_dump_json(exclude_none=True)
+        return f"data: {record}\n\n" if use_sse else record + "\n"
+
+    async def answer_group(group: List[int]) -> Tuple[List[int], Optional[List[Tuple[int, str]]]]:
+        # One group's failure must not end the stream or cancel the other groups
+        try:
+            return group, await _answer_group(payload.questions, contexts, group)
+        except Exception:
+            logger.exception("Answering questions %s failed", group)
+            return group, None
+
+    async def records():
+        answerable = {i for g in groups for i in g}
+        for i in range(len(payload.questions)):
+            if i not in answerable:
+                yield encode(i, NOT_FOUND_ANSWER)
+
+        tasks = [asyncio.create_task(answer_group(g)) for g in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                group, results = await next_done
+                if results is None:
+                    for i in group:
+                        yield encode(i, "", error="Failed to generate an answer")
+                    continue
+                for i, answer in results:
+                    yield encode(i, answer)
+        finally:
+            # Client went away mid-stream: stop paying for answers nobody will read
+            for task in tasks:
+                task.cancel()
+
+    media_type = "text/event-stream" if use_sse else "application/x-ndjson"
+    return StreamingResponse(records(), media_type=media_type)
+
+
+@router.get("/hackrx/stats")
+async def stats_endpoint(authorization: str = Header(default="")):
+    """Counters since startup: LLM token usage and per-call prompt caching, OpenAI scheduler
+    state per model, answer cache hit rates, and cached documents with their ingestion peak RSS"""
+    _authorize(authorization)
+    return {
+        "llm": {"token_usage": token_usage, "recent_calls": list(recent_calls)},
+        "schedulers": scheduler_stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "documents": document_cache.stats(),
+    }
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+_KMEANS_SAMPLE_PER_LIST = 32  # Training points per centroid
+_KMEANS_ITERATIONS = 8
+_ASSIGN_BLOCK_ROWS = 8192
+
+
+def default_list_count(n: int) -> int:
+    return max(1, int(2 * math.sqrt(n)))
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) of every row, in blocks to bound the score matrix"""
+    labels = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), _ASSIGN_BLOCK_ROWS):
+        labels[start:start + _ASSIGN_BLOCK_ROWS] = np.argmax(x[start:start + _ASSIGN_BLOCK_ROWS] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(x: np.ndarray, n_lists: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Unit-norm centroids for unit-norm rows, trained on a sample"""
+    rng = rng or np.random.default_rng(0)
+    sample_size = min(len(x), n_lists * _KMEANS_SAMPLE_PER_LIST)
+    sample = x[np.sort(rng.choice(len(x), sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(_KMEANS_ITERATIONS):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = np.bincount(labels, minlength=n_lists) == 0
+        # Re-seed empty lists from random sample points
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+    return centroids.astype(np.float32, copy=False)
+
+
+class IVFIndex:
+    """Inverted-file inner-product index in numpy, the same idea as FAISS IndexIVFFlat.
+
+    Rows are clustered around `n_lists` k-means centroids and stored grouped by list,
+    so a probed list is a contiguous slice. A query scores the `n_probe` lists whose
+    centroids are closest to it, not every row.
+    """
+
+    def __init__(self, x: np.ndarray, n_lists: int, n_probe: int):
+        n_lists = max(1, min(n_lists, len(x)))
+        self.n_probe = max(1, min(n_probe, n_lists))
+        self.centroids = spherical_kmeans(x, n_lists)
+        labels = _assign(x, self.centroids)
+        self.ids = np.argsort(labels, kind="stable").astype(np.int64)
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=self.offsets[1:])
+        # Like IndexIVFFlat, keep a list-ordered copy so every probe is a contiguous slice
+        self.vectors = x[self.ids]
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.ids.nbytes + self.centroids.nbytes + self.offsets.nbytes
+
+    def search(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, scores) of the approximate top-k per row of `q`, best first.
+
+        Queries whose probed lists hold fewer than k rows are padded with -1 / -inf.
+        """
+        nq = q.shape[0]
+        probes = np.argpartition(-(q @ self.centroids.T), self.n_probe - 1, axis=1)[:, :self.n_probe] \
+            if self.n_probe < len(self.centroids) else np.broadcast_to(np.arange(len(self.centroids)), (nq, len(self.centroids)))
+        indices = np.full((nq, k), -1, dtype=np.int64)
+        scores = np.full((nq, k), -np.inf, dtype=np.float32)
+        for row in range(nq):
+            lists = probes[row]
+            # Score each probed list as a slice in place; gathering the rows would copy them
+            sims = np.concatenate([self.vectors[self.offsets[l]:self.offsets[l + 1]] @ q[row] for l in lists])
+            if len(sims) == 0:
+                continue
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            m = min(k, len(rows))
+            top = np.argpartition(-sims, m - 1)[:m] if m < len(rows) else np.arange(len(rows))
+            top = top[np.argsort(-sims[top], kind="stable")]
+            indices[row, :m] = self.ids[rows[top]]
+            scores[row, :m] = sims[top]
+        return indices, scores
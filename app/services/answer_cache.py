@@ -0,0 +1,134 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ..config import (
+    ENABLE_CACHING,
+    CACHE_TTL_HOURS,
+    ANSWER_CACHE_MAX_BYTES,
+    ANSWER_CACHE_DB_PATH,
+)
+
+# Rough per-entry overhead of the key, tuple and OrderedDict node
+_ENTRY_OVERHEAD_BYTES = 200
+_DISK_PRUNE_EVERY_PUTS = 256
+
+
+def answer_key(model: str, prompt_version: str, context_blocks: List[str], question: str) -> str:
+    """sha256 over every input that can change the answer; parts are length-prefixed"""
+    h = hashlib.sha256()
+    for part in (model, prompt_version, question, *context_blocks):
+        data = part.encode("utf-8", errors="surrogatepass")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """LRU+TTL answer cache bounded by bytes, backed by an optional SQLite file"""
+
+    def __init__(self, max_bytes: int, ttl_secs: float, db_path: str = ""):
+        self.max_bytes = max_bytes
+        self.ttl_secs = ttl_secs
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                self._prune_disk(time.time())
+            except sqlite3.Error:
+                self._db = None
+
+    def _prune_disk(self, now: float) -> None:
+        if self.ttl_secs > 0:
+            self._db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_secs,))
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_secs > 0 and now - created > self.ttl_secs
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None and not self._expired(row[1], now):
+                    self._insert(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, answer: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._insert(key, answer, now)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO answers (key, answer, created) VALUES (?, ?, ?)",
+                                     (key, answer, now))
+                    self._puts += 1
+                    if self._puts % _DISK_PRUNE_EVERY_PUTS == 0:
+                        self._prune_disk(now)
+                except sqlite3.Error:
+                    pass
+
+    def _insert(self, key: str, answer: str, created: float) -> None:
+        self._remove(key)
+        size = len(answer.encode("utf-8", errors="surrogatepass")) + len(key) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (answer, created, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+answer_cache: Optional[AnswerCache] = (
+    AnswerCache(ANSWER_CACHE_MAX_BYTES, CACHE_TTL_HOURS * 3600, ANSWER_CACHE_DB_PATH) if ENABLE_CACHING else None
+)
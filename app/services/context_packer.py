@@ -0,0 +1,132 @@
+from __future__ import annotations
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import tiktoken  # type: ignore
+except Exception:
+    tiktoken = None
+
+from ..config import OPENAI_MODEL, CONTEXT_TOKEN_BUDGET
+from ..utils.chunking import PAGE_BREAK, PARAGRAPH_BREAK
+from .embeddings import estimate_tokens
+from .retrieval import Chunk
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_SEPARATOR = "\n\n"  # Between non-contiguous spans of the document
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """The model's tiktoken encoding, or None when tiktoken (or its BPE file) is unavailable"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if tiktoken is not None:
+                    try:
+                        _encoding = tiktoken.encoding_for_model(OPENAI_MODEL)
+                    except Exception as e:
+                        logger.warning("tiktoken encoding for %s unavailable, estimating tokens: %s", OPENAI_MODEL, e)
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max(0, max_tokens - 1) * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+@dataclass
+class PackedContext:
+    blocks: List[str]  # Contiguous document spans, in document order
+    tokens: int  # Tokens of the blocks joined by CONTEXT_SEPARATOR
+    chunk_ids: List[int] = field(default_factory=list)  # Chunks included, in priority order
+    dropped: int = 0  # Chunks left out to stay within the budget
+
+    @property
+    def text(self) -> str:
+        return CONTEXT_SEPARATOR.join(self.blocks)
+
+
+def _merge(spans: List[Tuple[int, int]], source: str) -> List[Tuple[int, int]]:
+    """Union of sorted spans, joining ones that overlap or are separated only by whitespace"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in spans:
+        if merged and (start <= merged[-1][1] or not source[merged[-1][1]:start].strip()):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _span_text(source: str, span: Tuple[int, int]) -> str:
+    return source[span[0]:span[1]].replace(PAGE_BREAK, PARAGRAPH_BREAK)
+
+
+def pack_context(chunks: Sequence[Chunk], budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """Fit retrieved chunks into `budget` tokens without repeating any text.
+
+    `chunks` are spans of one document in priority (score) order. Overlapping and
+    adjacent chunks are merged back into contiguous spans, so the words chunk overlap
+    duplicates are sent once. Chunks are added best first while the merged spans still fit;
+    one that would overflow is skipped in favour of later, smaller ones. If not even the
+    best chunk fits, it is cut to the budget.
+    """
+    if not chunks:
+        return PackedContext(blocks=[], tokens=0)
+    source = chunks[0].source
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    span_tokens: Dict[Tuple[int, int], int] = {}
+
+    def cost(spans: List[Tuple[int, int]]) -> int:
+        for span in spans:
+            if span not in span_tokens:
+                span_tokens[span] = count_tokens(_span_text(source, span))
+        return sum(span_tokens[s] for s in spans) + separator_tokens * (len(spans) - 1)
+
+    selected: List[Tuple[int, int]] = []
+    merged: List[Tuple[int, int]] = []
+    chunk_ids: List[int] = []
+    tokens = 0
+    for chunk in chunks:
+        candidate = _merge(sorted(selected + [(chunk.start, chunk.end)]), source)
+        candidate_tokens = cost(candidate)
+        if candidate_tokens <= budget:
+            selected.append((chunk.start, chunk.end))
+            merged, tokens = candidate, candidate_tokens
+            chunk_ids.append(chunk.id)
+
+    if not selected:
+        text = truncate_to_tokens(_span_text(source, (chunks[0].start, chunks[0].end)), budget)
+        return PackedContext(blocks=[text], tokens=count_tokens(text), chunk_ids=[chunks[0].id],
+                             dropped=len(chunks) - 1)
+    return PackedContext(blocks=[_span_text(source, span) for span in merged], tokens=tokens,
+                         chunk_ids=chunk_ids, dropped=len(chunks) - len(chunk_ids))
+
+
+def interleave_chunks(chunks_per_question: Sequence[Sequence[Chunk]]) -> List[Chunk]:
+    """Union of several questions' chunks, taken rank by rank so a tight budget cuts evenly"""
+    merged: List[Chunk] = []
+    seen = set()
+    for rank in range(max((len(c) for c in chunks_per_question), default=0)):
+        for chunks in chunks_per_question:
+            if rank < len(chunks) and chunks[rank].id not in seen:
+                seen.add(chunks[rank].id)
+                merged.append(chunks[rank])
+    return merged
@@ -0,0 +1,262 @@
+from __future__ import annotations
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from ..config import (
+    BOILERPLATE_MIN_PAGE_FRACTION,
+    BOILERPLATE_MIN_PAGES,
+    BOILERPLATE_SAMPLE_PAGES,
+    DEDUP_ENABLED,
+    ENABLE_CACHING,
+    DEFAULT_CHUNK_WORDS,
+    DEFAULT_CHUNK_OVERLAP_WORDS,
+    DOCUMENT_CACHE_MAX_BYTES,
+    DOCUMENT_CACHE_REVALIDATE_SECS,
+    PIPELINE_ENABLED,
+    SNAPSHOT_DIR,
+    SNAPSHOT_WARM_URLS,
+)
+from ..utils.chunking import chunk_spans
+from ..utils.dedup import strip_boilerplate
+from ..utils.memory import RssTracker
+from ..utils.singleflight import SingleFlight
+from .document_ingestion import DownloadedBlob, detect_type, download_blob, parse_document_async
+from .embeddings import embed_texts
+from .ingestion_pipeline import ingest_pdf_pipelined, new_duplicate_filter
+from .metadata import DocumentMetadata
+from .retrieval import Retriever, Chunk
+from .snapshots import find_snapshot, load_snapshot, save_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentError(Exception):
+    pass
+
+
+@dataclass
+class IngestedDocument:
+    url: str
+    content_hash: str
+    text: str
+    chunks: List[Chunk]
+    retriever: Retriever
+    metadata: DocumentMetadata
+    nbytes: int = 0
+    peak_rss_bytes: int = 0  # Process RSS growth observed while this document was ingested
+    verified_at: float = field(default_factory=time.time)
+
+
+def estimate_document_bytes(text: str, chunks: List[Chunk], retriever: Retriever,
+                            metadata: DocumentMetadata) -> int:
+    """Approximate resident size of a cached document"""
+    total = sys.getsizeof(text)
+    # Chunks are spans into `text`, so only the objects themselves add up
+    total += sum(sys.getsizeof(c) + sys.getsizeof(c.__dict__) for c in chunks)
+    total += retriever.nbytes + metadata.nbytes
+    return total
+
+
+class DocumentCache:
+    """LRU of ingested documents bounded by estimated memory, keyed by (url, content sha256)"""
+
+    def __init__(self, max_bytes: int, revalidate_secs: float):
+        self.max_bytes = max_bytes
+        self.revalidate_secs = revalidate_secs
+        self._entries: "OrderedDict[Tuple[str, str], IngestedDocument]" = OrderedDict()
+        self._latest: dict = {}  # url -> content hash of its most recent version
+        self.total_bytes = 0
+
+    def get_fresh(self, url: str) -> Optional[IngestedDocument]:
+        """Entry for a URL that was verified recently enough to skip downloading it"""
+        content_hash = self._latest.get(url)
+        if content_hash is None:
+            return None
+        doc = self._entries.get((url, content_hash))
+        if doc is None or time.time() - doc.verified_at > self.revalidate_secs:
+            return None
+        self._entries.move_to_end((url, content_hash))
+        return doc
+
+    def get(self, url: str, content_hash: str) -> Optional[IngestedDocument]:
+        doc = self._entries.get((url, content_hash))
+        if doc is None:
+            return None
+        doc.verified_at = time.time()
+        self._latest[url] = content_hash
+        self._entries.move_to_end((url, content_hash))
+        return doc
+
+    def put(self, doc: IngestedDocument) -> None:
+        key = (doc.url, doc.content_hash)
+        previous_hash = self._latest.get(doc.url)
+        if previous_hash is not None and previous_hash != doc.content_hash:
+            # The URL now serves different content; the old version can never be hit again
+            self._remove((doc.url, previous_hash))
+        self._remove(key)
+        if doc.nbytes > self.max_bytes:
+            return
+        self._entries[key] = doc
+        self._latest[doc.url] = doc.content_hash
+        self.total_bytes += doc.nbytes
+        while self.total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        doc = self._entries.pop(key, None)
+        if doc is None:
+            return
+        self.total_bytes -= doc.nbytes
+        if self._latest.get(key[0]) == key[1]:
+            del self._latest[key[0]]
+
+    def stats(self) -> dict:
+        """Cache totals and, per cached document, its size and the RSS growth seen while ingesting it"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "documents": [
+                {
+                    "url": doc.url,
+                    "content_hash": doc.content_hash,
+                    "chunks": len(doc.chunks),
+                    "nbytes": doc.nbytes,
+                    "peak_rss_bytes": doc.peak_rss_bytes,
+                } for doc in self._entries.values()
+            ],
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+document_cache = DocumentCache(DOCUMENT_CACHE_MAX_BYTES, DOCUMENT_CACHE_REVALIDATE_SECS)
+# Concurrent requests for the same URL share one download/parse/embed pipeline
+_ingestions = SingleFlight()
+
+
+async def build_document(url: str, blob: DownloadedBlob, memory: RssTracker) -> IngestedDocument:
+    try:
+        if PIPELINE_ENABLED and detect_type(url, blob.content_type) == "pdf":
+            full_text, chunks, chunk_embeddings = await ingest_pdf_pipelined(blob.source, memory)
+            if not full_text:
+                raise DocumentError("Failed to parse document")
+        else:
+            full_text = await parse_document_async(url, blob.source, blob.content_type, memory)
+            if not full_text:
+                raise DocumentError("Failed to parse document")
+            if DEDUP_ENABLED:
+                full_text = strip_boilerplate(full_text, BOILERPLATE_SAMPLE_PAGES, BOILERPLATE_MIN_PAGE_FRACTION,
+                                              BOILERPLATE_MIN_PAGES)
+            spans = chunk_spans(full_text, DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS)
+            chunks = [Chunk(id=cid, source=full_text, start=start, end=end) for start, end, cid in spans]
+            duplicates = new_duplicate_filter()
+            if duplicates is not None:
+                chunks = [c for c, kept in zip(chunks, duplicates.keep([c.text for c in chunks])) if kept]
+            chunk_embeddings = await embed_texts([c.text for c in chunks]) if chunks else None
+    finally:
+        blob.close()
+
+    if not chunks:
+        raise DocumentError("No content after parsing")
+
+    # BM25 and (for large documents) IVF indexes are built here; keep that off the event loop
+    # The embeddings matrix is ours alone, so it is normalised in place rather than copied
+    retriever = await asyncio.to_thread(Retriever, chunk_embeddings, chunks, copy=False)
+    # Identifiers and section headings are located once here rather than per question
+    metadata = await asyncio.to_thread(DocumentMetadata, full_text)
+    memory.sample()
+    doc = IngestedDocument(url=url, content_hash=blob.sha256, text=full_text, chunks=chunks, retriever=retriever,
+                           metadata=metadata)
+    doc.nbytes = estimate_document_bytes(full_text, chunks, retriever, metadata)
+    doc.peak_rss_bytes = memory.peak_delta_bytes
+    logger.info("Ingested %s: %d bytes (%s), %d chunks, peak RSS +%.1f MB",
+                url, blob.size, "spooled" if blob.path else "in memory", len(chunks),
+                doc.peak_rss_bytes / (1024 * 1024))
+    return doc
+
+
+def _document_from_snapshot(url: str, content_hash: str) -> Optional[IngestedDocument]:
+    try:
+        snapshot = load_snapshot(content_hash)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", content_hash, e)
+        return None
+    if snapshot is None:
+        return None
+    doc = IngestedDocument(url=url, content_hash=content_hash, text=snapshot.text, chunks=snapshot.chunks,
+                           retriever=snapshot.retriever, metadata=DocumentMetadata(snapshot.text),
+                           verified_at=snapshot.meta["created"])
+    doc.nbytes = estimate_document_bytes(doc.text, doc.chunks, doc.retriever, doc.metadata)
+    return doc
+
+
+async def _save_snapshot(doc: IngestedDocument) -> None:
+    try:
+        await asyncio.to_thread(save_snapshot, doc.url, doc.content_hash, doc.text, doc.chunks, doc.retriever)
+    except OSError as e:
+        logger.warning("Could not snapshot %s: %s", doc.url, e)
+
+
+async def _load_document(url: str) -> IngestedDocument:
+    memory = RssTracker()
+    blob = await download_blob(url, memory)
+    doc = document_cache.get(url, blob.sha256)
+    if doc is not None:
+        blob.close()
+        return doc
+
+    # Another worker (or an earlier run) may already have embedded this exact content
+    doc = await asyncio.to_thread(_document_from_snapshot, url, blob.sha256) if SNAPSHOT_DIR else None
+    if doc is not None:
+        blob.close()
+        doc.verified_at = time.time()
+        document_cache.put(doc)
+        return doc
+
+    doc = await build_document(url, blob, memory)
+    document_cache.put(doc)
+    if SNAPSHOT_DIR:
+        await _save_snapshot(doc)
+    return doc
+
+
+async def warm_snapshots(urls: List[str] = SNAPSHOT_WARM_URLS) -> int:
+    """Load the newest snapshot of each URL into the document cache; returns how many loaded.
+
+    A snapshot counts as verified when it was written, so a recent one is served without
+    downloading; an older one is revalidated against the URL on first use, but still
+    skips parsing and embedding if the content is unchanged.
+    """
+    if not (ENABLE_CACHING and SNAPSHOT_DIR):
+        return 0
+    loaded = 0
+    for url in urls:
+        content_hash = await asyncio.to_thread(find_snapshot, url)
+        doc = await asyncio.to_thread(_document_from_snapshot, url, content_hash) if content_hash else None
+        if doc is None:
+            logger.info("No snapshot to warm for %s", url)
+            continue
+        document_cache.put(doc)
+        loaded += 1
+    return loaded
+
+
+async def get_document(url: str) -> IngestedDocument:
+    """Parsed, chunked and indexed document, reusing a cached copy when the content is unchanged"""
+    if not ENABLE_CACHING:
+        memory = RssTracker()
+        return await build_document(url, await download_blob(url, memory), memory)
+
+    doc = document_cache.get_fresh(url)
+    if doc is not None:
+        return doc
+
+    return await _ingestions.do(url, lambda: _load_document(url))
@@ -1,20 +1,94 @@
 from __future__ import annotations
 import asyncio
+import hashlib
 import io
-from typing import Tuple
+import multiprocessing
+import os
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple, Union
 
-import httpx
+from ..config import (
+    MAX_DOCUMENT_BYTES,
+    DOWNLOAD_SPOOL_THRESHOLD_BYTES,
+    PDF_PARSE_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_RANGE,
+)
+from ..utils.chunking import clean_text, PAGE_BREAK
+from ..utils.memory import RssTracker
+from .http_clients import get_blob_client
 
-from ..config import HTTP_TIMEOUT_SECS
-from ..utils.chunking import clean_text
+# Parsers take either the raw bytes or the path of a spooled temp file
+Source = Union[bytes, str]
 
 
-async def download_blob(url: str) -> Tuple[bytes, str]:
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT_SECS) as client:
-        resp = await client.get(url)
-        resp.raise_for_status()
-        content_type = resp.headers.get("content-type", "").lower()
-        return resp.content, content_type
+class DocumentTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class DownloadedBlob:
+    content_type: str
+    size: int
+    sha256: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+    @property
+    def source(self) -> Source:
+        return self.data if self.path is None else self.path
+
+    def close(self) -> None:
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+async def download_blob(url: str, memory: Optional[RssTracker] = None) -> DownloadedBlob:
+    """Stream a document, keeping small bodies in memory and spilling large ones to a temp file"""
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spool = None
+    size = 0
+    try:
+        async with get_blob_client().stream("GET", url) as resp:
+            resp.raise_for_status()
+            content_type = resp.headers.get("content-type", "").lower()
+            declared = resp.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > MAX_DOCUMENT_BYTES:
+                raise DocumentTooLargeError(f"Document exceeds {MAX_DOCUMENT_BYTES} bytes")
+
+            async for piece in resp.aiter_bytes():
+                size += len(piece)
+                if size > MAX_DOCUMENT_BYTES:
+                    raise DocumentTooLargeError(f"Document exceeds {MAX_DOCUMENT_BYTES} bytes")
+                digest.update(piece)
+                if spool is None and size > DOWNLOAD_SPOOL_THRESHOLD_BYTES:
+                    spool = tempfile.NamedTemporaryFile(prefix="hackrx-", suffix=".blob", delete=False)
+                    spool.write(buffer)
+                    buffer = bytearray()
+                if spool is None:
+                    buffer += piece
+                else:
+                    spool.write(piece)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+            os.unlink(spool.name)
+        raise
+
+    if memory is not None:
+        memory.sample()
+    if spool is None:
+        return DownloadedBlob(content_type, size, digest.hexdigest(), data=bytes(buffer))
+    spool.close()
+    return DownloadedBlob(content_type, size, digest.hexdigest(), path=spool.name)
 
 
 def detect_type(url: str, content_type: str) -> str:
@@ -34,31 +108,135 @@ def detect_type(url: str, content_type: str) -> str:
     return "pdf"
 
 
-def parse_pdf(data: bytes) -> str:
+def _open_pdf(source: Source):
     import fitz
 
-    with fitz.open(stream=data, filetype="pdf") as doc:
+    if isinstance(source, str):
+        # MuPDF reads pages from the file on demand instead of holding a second in-memory copy
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def _page_text(page) -> str:
+    """Raw text of a page with a blank line between text blocks, which clean_text keeps as paragraphs"""
+    return "\n\n".join(block[4] for block in page.get_text("blocks") if block[6] == 0)
+
+
+def iter_pdf_pages(source: Source, memory: Optional[RssTracker] = None) -> Iterator[str]:
+    """Cleaned text of each non-empty page, yielded as soon as it is extracted"""
+    with _open_pdf(source) as doc:
+        for page in doc:
+            page_text = clean_text(_page_text(page))
+            if memory is not None:
+                memory.sample()
+            if page_text:
+                yield page_text
+
+
+def parse_pdf(source: Source, memory: Optional[RssTracker] = None) -> str:
+    with _open_pdf(source) as doc:
         texts = []
         for page in doc:
-            page_text = page.get_text("text")
+            page_text = _page_text(page)
             if page_text:
                 texts.append(page_text)
-    return clean_text("\n\n".join(texts))
+            if memory is not None:
+                memory.sample()
+    return clean_text(PAGE_BREAK.join(texts))
+
+
+def extract_page_range(source: Source, start: int, end: int) -> str:
+    """Cleaned text of pages [start, end); runs in a parse worker process"""
+    with _open_pdf(source) as doc:
+        texts = []
+        for page_no in range(start, end):
+            page_text = _page_text(doc[page_no])
+            if page_text:
+                texts.append(page_text)
+    return clean_text(PAGE_BREAK.join(texts))
 
 
-def parse_docx(data: bytes) -> str:
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        # spawn: forking a process that already runs the event loop and HTTP pools isn't safe
+        _parse_pool = ProcessPoolExecutor(max_workers=PDF_PARSE_WORKERS,
+                                          mp_context=multiprocessing.get_context("spawn"))
+    return _parse_pool
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+
+def pdf_page_count(source: Source) -> int:
+    with _open_pdf(source) as doc:
+        return doc.page_count
+
+
+@contextmanager
+def spooled_source(source: Source) -> Iterator[str]:
+    """Path to the document, writing in-memory bytes to a temp file for the block's duration.
+
+    Parse workers receive their arguments pickled, so passing a path instead of the bytes
+    avoids copying the whole PDF to the pool once per page range.
+    """
+    if isinstance(source, str):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(prefix="hackrx-", suffix=".pdf", delete=False) as spool:
+        spool.write(source)
+    try:
+        yield spool.name
+    finally:
+        try:
+            os.unlink(spool.name)
+        except OSError:
+            pass
+
+
+def plan_page_ranges(page_count: int, workers: int, pages_per_range: int) -> List[Tuple[int, int]]:
+    size = max(1, min(pages_per_range, -(-page_count // max(1, workers))))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+async def parse_pdf_parallel(source: Source, page_count: int, memory: Optional[RssTracker] = None) -> str:
+    """Extract page ranges on the parse process pool and join them in page order"""
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    ranges = plan_page_ranges(page_count, PDF_PARSE_WORKERS, PDF_PAGES_PER_RANGE)
+    with spooled_source(source) as path:
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(pool, extract_page_range, path, start, end) for start, end in ranges
+        ])
+    if memory is not None:
+        memory.sample()
+    # Each part is already cleaned, so joining with a page break matches parse_pdf
+    return PAGE_BREAK.join(p for p in parts if p)
+
+
+def parse_docx(source: Source) -> str:
     from docx import Document
 
-    fh = io.BytesIO(data)
-    doc = Document(fh)
+    doc = Document(source if isinstance(source, str) else io.BytesIO(source))
     paragraphs = [p.text for p in doc.paragraphs if p.text and p.text.strip()]
     return clean_text("\n\n".join(paragraphs))
 
 
-def parse_email(data: bytes) -> str:
-    from email import message_from_bytes
+def parse_email(source: Source) -> str:
+    from email import message_from_binary_file, message_from_bytes
 
-    msg = message_from_bytes(data)
+    if isinstance(source, str):
+        with open(source, "rb") as fh:
+            msg = message_from_binary_file(fh)
+    else:
+        msg = message_from_bytes(source)
     texts = []
     if msg.is_multipart():
         for part in msg.walk():
@@ -74,22 +252,39 @@ def parse_email(data: bytes) -> str:
     return clean_text("\n\n".join(texts))
 
 
-async def ingest_document(url: str) -> str:
-    data, content_type = await download_blob(url)
+def parse_document(url: str, source: Source, content_type: str, memory: Optional[RssTracker] = None) -> str:
     kind = detect_type(url, content_type)
 
     if kind == "pdf":
-        return await asyncio.to_thread(parse_pdf, data)
-    if kind == "docx":
-        return await asyncio.to_thread(parse_docx, data)
-    if kind == "email":
-        return await asyncio.to_thread(parse_email, data)
+        text = parse_pdf(source, memory)
+    elif kind == "docx":
+        text = parse_docx(source)
+    elif kind == "email":
+        text = parse_email(source)
+    else:
+        try:
+            text = parse_pdf(source, memory)
+        except Exception:
+            try:
+                if isinstance(source, str):
+                    with open(source, "rb") as fh:
+                        source = fh.read()
+                text = clean_text(source.decode("utf-8", errors="ignore"))
+            except Exception:
+                text = ""
+    if memory is not None:
+        memory.sample()
+    return text
 
-    try:
-        return await asyncio.to_thread(parse_pdf, data)
-    except Exception:
+
+async def parse_document_async(url: str, source: Source, content_type: str,
+                               memory: Optional[RssTracker] = None) -> str:
+    """parse_document off the event loop; large PDFs are split across the parse process pool"""
+    if PDF_PARSE_WORKERS > 0 and detect_type(url, content_type) == "pdf":
         try:
-            text = data.decode("utf-8", errors="ignore")
-            return clean_text(text)
+            page_count = await asyncio.to_thread(pdf_page_count, source)
         except Exception:
-            return ""
+            page_count = 0
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            return await parse_pdf_parallel(source, page_count, memory)
+    return await asyncio.to_thread(parse_document, url, source, content_type, memory)
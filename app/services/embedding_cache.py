@@ -0,0 +1,245 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import (
+    ENABLE_CACHING,
+    CACHE_TTL_HOURS,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_SIZE_LIMIT,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+)
+
+# Index records are written oldest-access first so LRU order survives a restart
+_INDEX_DTYPE = np.dtype([("key", "S32"), ("slot", "<i4"), ("created", "<f8"), ("accessed", "<f8")])
+_INDEX_FILE = "index-v1.npy"
+_VECTORS_FILE = "vectors-v1.f32"
+_GROW_ROWS = 1024
+_FLUSH_INTERVAL_SECS = 30.0
+
+
+def embedding_key(text: str, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS) -> bytes:
+    """Content address of a vector: sha256(model, dimensions, text)"""
+    h = hashlib.sha256()
+    h.update(model.encode())
+    h.update(b"\0")
+    h.update(str(dimensions).encode())
+    h.update(b"\0")
+    h.update(text.encode("utf-8", errors="surrogatepass"))
+    return h.digest()
+
+
+class EmbeddingStore:
+    """On-disk LRU+TTL store of float32 vectors.
+
+    Layout per (model, dimensions) directory:
+      - vectors-v1.f32: raw (slots, dimensions) float32 matrix, memory-mapped and grown in blocks
+      - index-v1.npy: structured array of (sha256 key, slot, created, accessed)
+
+    Meant for a single process; each uvicorn worker should get its own directory.
+    """
+
+    def __init__(self, directory: str, dimensions: int, max_entries: int, ttl_secs: float):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self._lock = threading.Lock()
+        # key -> (slot, created); iteration order is least- to most-recently used
+        self._entries: "OrderedDict[bytes, Tuple[int, float]]" = OrderedDict()
+        self._accessed: Dict[bytes, float] = {}
+        self._free: List[int] = []
+        # Slots of dropped keys; the index on disk may still map those keys to them, so
+        # they are reused only after the next flush writes an index without them
+        self._released: List[int] = []
+        self._rows = 0
+        self._vectors: Optional[np.memmap] = None
+        self._dirty = False
+        self._last_flush = time.time()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.directory, _VECTORS_FILE)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, _INDEX_FILE)
+
+    def _load(self) -> None:
+        row_bytes = self.dimensions * 4
+        if os.path.exists(self._vectors_path):
+            self._rows = os.path.getsize(self._vectors_path) // row_bytes
+        if self._rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                      shape=(self._rows, self.dimensions))
+        used = set()
+        if os.path.exists(self._index_path) and self._rows:
+            try:
+                records = np.load(self._index_path, allow_pickle=False)
+            except Exception:
+                records = np.zeros(0, dtype=_INDEX_DTYPE)
+            if records.dtype == _INDEX_DTYPE:
+                for rec in np.sort(records, order="accessed"):
+                    slot = int(rec["slot"])
+                    if 0 <= slot < self._rows and slot not in used:
+                        # numpy strips trailing zero bytes from "S32" values; keys are always 32 bytes
+                        key = bytes(rec["key"]).ljust(32, b"\0")
+                        self._entries[key] = (slot, float(rec["created"]))
+                        self._accessed[key] = float(rec["accessed"])
+                        used.add(slot)
+        self._free = [s for s in range(self._rows - 1, -1, -1) if s not in used]
+        self._evict_expired(time.time())
+
+    def _grow(self, min_rows: int) -> None:
+        rows = max(min_rows, self._rows + _GROW_ROWS)
+        # One block of slack past max_entries holds new vectors while released slots wait for a flush
+        rows = min(rows, max(self.max_entries + _GROW_ROWS, min_rows))
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as fh:
+            fh.truncate(rows * self.dimensions * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(rows, self.dimensions))
+        self._free.extend(range(rows - 1, self._rows - 1, -1))
+        self._rows = rows
+
+    def _drop(self, key: bytes) -> None:
+        slot, _ = self._entries.pop(key)
+        self._accessed.pop(key, None)
+        self._released.append(slot)
+        self._dirty = True
+
+    def _take_slot(self, now: float) -> int:
+        if not self._free:
+            if self._released and self._rows >= self.max_entries + _GROW_ROWS:
+                self._flush_locked(now)
+            else:
+                self._grow(self._rows + 1)
+        return self._free.pop()
+
+    def _evict_expired(self, now: float) -> None:
+        if self.ttl_secs <= 0:
+            return
+        expired = [k for k, (_, created) in self._entries.items() if now - created > self.ttl_secs]
+        for k in expired:
+            self._drop(k)
+
+    def get_many(self, keys: List[bytes]) -> Tuple[List[int], np.ndarray]:
+        """Return (positions in `keys` that hit, their vectors as a fresh float32 matrix)"""
+        now = time.time()
+        positions: List[int] = []
+        slots: List[int] = []
+        with self._lock:
+            for pos, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                slot, created = entry
+                if self.ttl_secs > 0 and now - created > self.ttl_secs:
+                    self._drop(key)
+                    continue
+                self._entries.move_to_end(key)
+                self._accessed[key] = now
+                positions.append(pos)
+                slots.append(slot)
+            if positions:
+                self._dirty = True
+                vectors = np.array(self._vectors[slots], dtype=np.float32)
+            else:
+                vectors = np.zeros((0, self.dimensions), dtype=np.float32)
+            if self._dirty and now - self._last_flush > _FLUSH_INTERVAL_SECS:
+                self._flush_locked(now)
+        return positions, vectors
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimensions:
+            return
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            for key, vec in zip(keys, vectors):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    slot = entry[0]
+                    self._entries.move_to_end(key)
+                else:
+                    while len(self._entries) >= self.max_entries:
+                        self._drop(next(iter(self._entries)))
+                    slot = self._take_slot(now)
+                self._vectors[slot] = vec
+                self._entries[key] = (slot, now)
+                self._accessed[key] = now
+            self._dirty = True
+            # Vectors are already in the mapped file; the index is rewritten at most every
+            # _FLUSH_INTERVAL_SECS rather than once per embedding batch
+            if now - self._last_flush > _FLUSH_INTERVAL_SECS:
+                self._flush_locked(now)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._flush_locked(time.time())
+
+    def _flush_locked(self, now: float) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+        records = np.zeros(len(self._entries), dtype=_INDEX_DTYPE)
+        if self._entries:
+            records["key"] = list(self._entries)
+            records["slot"] = [slot for slot, _ in self._entries.values()]
+            records["created"] = [created for _, created in self._entries.values()]
+            records["accessed"] = [self._accessed.get(key, created) for key, (_, created) in self._entries.items()]
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, records, allow_pickle=False)
+        os.replace(tmp_path, self._index_path)
+        # The index on disk no longer names the keys that held these slots
+        self._free.extend(self._released)
+        self._released = []
+        self._dirty = False
+        self._last_flush = now
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_stores: Dict[Tuple[str, int], EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS) -> Optional[EmbeddingStore]:
+    """Process-wide store for a model/width, or None when caching is disabled or the disk is unusable"""
+    if not ENABLE_CACHING:
+        return None
+    with _stores_lock:
+        store = _stores.get((model, dimensions))
+        if store is None:
+            try:
+                store = EmbeddingStore(
+                    os.path.join(EMBEDDING_CACHE_DIR, f"{model}-{dimensions}"),
+                    dimensions,
+                    EMBEDDING_CACHE_SIZE_LIMIT,
+                    CACHE_TTL_HOURS * 3600,
+                )
+            except OSError:
+                return None
+            _stores[(model, dimensions)] = store
+        return store
+
+
+def flush_embedding_stores() -> None:
+    """Write out index changes still held back by the flush throttle, e.g. at shutdown"""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
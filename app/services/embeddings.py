@@ -1,17 +1,70 @@
 from __future__ import annotations
-from typing import List
+import asyncio
+import base64
+import random
+import time
+from typing import Awaitable, Callable, List, Optional
 import numpy as np
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import orjson
 
-from ..config import OPENAI_API_KEY, HTTP_TIMEOUT_SECS
+from ..config import (
+    OPENAI_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_BATCH_MAX_ITEMS,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_ATTEMPTS,
+    EMBEDDING_DEADLINE_SECS,
+)
+from .embedding_cache import embedding_key, get_embedding_store
+from .http_clients import get_openai_client
+from .openai_scheduler import get_scheduler, parse_duration
 
 
 class EmbeddingError(Exception):
-    pass
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
 
 
-async def _embed_text_once(client: httpx.AsyncClient, text: str) -> List[float]:
+def _retry_hint(response: httpx.Response) -> Optional[float]:
+    """Server-requested wait from Retry-After or the x-ratelimit-reset-* headers"""
+    headers = response.headers
+    hint = parse_duration(headers.get("retry-after"))
+    if hint is None and response.status_code == 429:
+        resets = [parse_duration(headers.get(h)) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+        hint = max((r for r in resets if r is not None), default=None)
+    return hint
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def plan_batches(texts: List[str], max_items: int, max_tokens: int) -> List[List[int]]:
+    """Group text indices into consecutive batches under an item and token budget"""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, t in enumerate(texts):
+        n = estimate_tokens(t)
+        if current and (len(current) >= max_items or current_tokens + n > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _embed_batch_once(client: httpx.AsyncClient, inputs: List[str], out: np.ndarray) -> None:
+    """Embed `inputs` into the rows of `out` (a float32 view, one row per input), unit-normalised"""
     if not OPENAI_API_KEY:
         raise EmbeddingError("OPENAI_API_KEY not set")
 
@@ -20,39 +73,151 @@ async def _embed_text_once(client: httpx.AsyncClient, text: str) -> List[float]:
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json"
     }
-    
+
+    # base64 is raw little-endian float32: no JSON float parsing or per-value Python objects
     payload = {
-        "model": "text-embedding-3-small",  # Best performing embedding model
-        "input": text,
-        "encoding_format": "float"
+        "model": EMBEDDING_MODEL,
+        "input": inputs,
+        "dimensions": EMBEDDING_DIMENSIONS,
+        "encoding_format": "base64"
     }
 
     try:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        data = r.json()
-        values = data.get("data", [{}])[0].get("embedding")
-        if not values:
+        async with get_scheduler(EMBEDDING_MODEL).slot(sum(estimate_tokens(t) for t in inputs)) as slot:
+            r = await client.post(url, headers=headers, content=orjson.dumps(payload))
+            slot.observe(r)
+            r.raise_for_status()
+            body = orjson.loads(r.content)
+            slot.settle((body.get("usage") or {}).get("total_tokens"))
+        data = body.get("data") or []
+        if len(data) != len(inputs):
+            raise EmbeddingError(f"Expected {len(inputs)} embeddings, got {len(data)}")
+        # The API tags each vector with the position of its input; don't rely on list order
+        filled = np.zeros(len(inputs), dtype=bool)
+        for item in data:
+            vec = np.frombuffer(base64.b64decode(item.get("embedding") or b""), dtype="<f4")
+            if vec.shape[0] != out.shape[1]:
+                raise EmbeddingError(f"Expected {out.shape[1]} dimensions, got {vec.shape[0]}", retryable=False)
+            out[item["index"]] = vec
+            filled[item["index"]] = True
+        if not filled.all():
             raise EmbeddingError("No embedding values returned")
-        return values
+        out /= np.linalg.norm(out, axis=1, keepdims=True) + 1e-12
+    except EmbeddingError:
+        raise
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        # Rate limits, timeouts and server errors are worth another try; other 4xx are not
+        raise EmbeddingError(f"Embedding failed: {str(e)}", retryable=status in (408, 409, 429) or status >= 500,
+                             retry_after=_retry_hint(e.response))
     except Exception as e:
         raise EmbeddingError(f"Embedding failed: {str(e)}")
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=6), reraise=True,
-       retry=retry_if_exception_type((httpx.HTTPError, EmbeddingError)))
+async def _embed_batch(client: httpx.AsyncClient, inputs: List[str], out: np.ndarray, deadline: float) -> None:
+    """_embed_batch_once with retries for this batch only, bounded by the caller's deadline"""
+    attempt = 0
+    while True:
+        attempt += 1
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise EmbeddingError("Embedding deadline exceeded", retryable=False)
+        try:
+            await asyncio.wait_for(_embed_batch_once(client, inputs, out), timeout=remaining)
+            return
+        except asyncio.TimeoutError:
+            raise EmbeddingError("Embedding deadline exceeded", retryable=False)
+        except EmbeddingError as e:
+            if not e.retryable or attempt >= EMBEDDING_MAX_ATTEMPTS:
+                raise
+            # Exponential backoff with jitter, but never sooner than the server asked for
+            delay = min(6.0, 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+            if e.retry_after is not None:
+                delay = max(delay, e.retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise
+            await asyncio.sleep(delay)
+
+
+BatchCallback = Callable[[List[int], np.ndarray], Awaitable[None]]
+
+
+async def _embed_uncached(texts: List[str], on_batch: Optional[BatchCallback] = None) -> np.ndarray:
+    """Embed via the API in concurrent batches; each batch retries on its own.
+
+    `on_batch(indices, vectors)` runs as each batch lands, so finished work is kept
+    (e.g. in the embedding cache) even if a later batch finally fails.
+    """
+    batches = plan_batches(texts, EMBEDDING_BATCH_MAX_ITEMS, EMBEDDING_BATCH_MAX_TOKENS)
+    if not batches:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    deadline = time.monotonic() + EMBEDDING_DEADLINE_SECS
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    # The only copy of the vectors: every batch decodes straight into its own row range
+    out = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    client = get_openai_client()
+
+    async def run_batch(indices: List[int]) -> None:
+        rows = out[indices[0]:indices[-1] + 1]
+        async with semaphore:
+            await _embed_batch(client, [texts[i] for i in indices], rows, deadline)
+        if on_batch is not None:
+            await on_batch(indices, rows)
+
+    await asyncio.gather(*[run_batch(b) for b in batches])
+
+    return out
+
+
 async def embed_texts(texts: List[str]) -> np.ndarray:
-    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT_SECS) as client:
-        vectors: List[List[float]] = []
-        for t in texts:
-            values = await _embed_text_once(client, t)
-            vectors.append(values)
-        arr = np.array(vectors, dtype=np.float32)
-        return arr
-
-
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=6), reraise=True,
-       retry=retry_if_exception_type((httpx.HTTPError, EmbeddingError)))
-async def embed_query(text: str) -> np.ndarray:
-    vecs = await embed_texts([text])
-    return vecs[0]
+    """Embed texts in order, serving repeats from the on-disk cache and the API only for misses"""
+    store = get_embedding_store()
+    if store is None or not texts:
+        return await _embed_uncached(texts)
+
+    keys = [embedding_key(t) for t in texts]
+    hit_positions, hit_vectors = await asyncio.to_thread(store.get_many, keys)
+    if len(hit_positions) == len(texts):
+        return hit_vectors
+
+    # Identical chunks within one document only need to be embedded once
+    hit_set = set(hit_positions)
+    miss_slots: dict = {}
+    for pos, key in enumerate(keys):
+        if pos not in hit_set:
+            miss_slots.setdefault(key, []).append(pos)
+    miss_keys = list(miss_slots)
+    miss_texts = [texts[miss_slots[k][0]] for k in miss_keys]
+
+    async def store_batch(indices: List[int], vectors: np.ndarray) -> None:
+        # Cached per batch, so a retry of a failed call resumes where this one stopped
+        await asyncio.to_thread(store.put_many, [miss_keys[i] for i in indices], vectors)
+
+    miss_vectors = await _embed_uncached(miss_texts, store_batch)
+    if not hit_positions and len(miss_keys) == len(texts):
+        return miss_vectors
+
+    out = np.empty((len(texts), miss_vectors.shape[1]), dtype=np.float32)
+    if hit_positions and hit_vectors.shape[1] == out.shape[1]:
+        out[hit_positions] = hit_vectors
+    elif hit_positions:
+        # Stored width no longer matches the API; re-embed those too
+        return await _embed_uncached(texts)
+    for key, vec in zip(miss_keys, miss_vectors):
+        out[miss_slots[key]] = vec
+    return out
+
+
+async def embed_queries(texts: List[str]) -> np.ndarray:
+    """Embed a request's questions in one call; repeated questions are embedded once.
+
+    Row i of the result is the vector for texts[i].
+    """
+    unique = list(dict.fromkeys(texts))
+    vecs = await embed_texts(unique)
+    if len(unique) == len(texts):
+        return vecs
+    row_of = {t: i for i, t in enumerate(unique)}
+    return vecs[[row_of[t] for t in texts]]
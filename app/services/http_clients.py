@@ -0,0 +1,82 @@
+from __future__ import annotations
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # type: ignore  # noqa: F401
+    _HAS_H2 = True
+except Exception:
+    _HAS_H2 = False
+
+from ..config import (
+    HTTP_TIMEOUT_SECS,
+    BLOB_MAX_CONNECTIONS,
+    OPENAI_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY_SECS,
+    HTTP2_ENABLED,
+)
+
+BLOB_POOL = "blob"
+OPENAI_POOL = "openai"
+
+_POOL_LIMITS = {
+    BLOB_POOL: BLOB_MAX_CONNECTIONS,
+    OPENAI_POOL: OPENAI_MAX_CONNECTIONS,
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def _create_client(pool: str) -> httpx.AsyncClient:
+    max_connections = _POOL_LIMITS[pool]
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=min(HTTP_MAX_KEEPALIVE_CONNECTIONS, max_connections),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECS,
+    )
+    return httpx.AsyncClient(
+        timeout=HTTP_TIMEOUT_SECS,
+        limits=limits,
+        http2=HTTP2_ENABLED and _HAS_H2 and _transport is None,
+        transport=_transport,
+    )
+
+
+def get_client(pool: str) -> httpx.AsyncClient:
+    """Shared client for a pool, created on first use"""
+    client = _clients.get(pool)
+    if client is None or client.is_closed:
+        client = _create_client(pool)
+        _clients[pool] = client
+    return client
+
+
+def get_blob_client() -> httpx.AsyncClient:
+    return get_client(BLOB_POOL)
+
+
+def get_openai_client() -> httpx.AsyncClient:
+    return get_client(OPENAI_POOL)
+
+
+async def open_clients() -> None:
+    for pool in _POOL_LIMITS:
+        get_client(pool)
+
+
+async def close_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def set_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    """Route every pool through `transport` (e.g. httpx.MockTransport or an ASGITransport
+    wrapping a local stand-in server); None restores real network transports."""
+    global _transport
+    await close_clients()
+    _transport = transport
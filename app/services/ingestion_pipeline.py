@@ -0,0 +1,203 @@
+from __future__ import annotations
+import asyncio
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..config import (
+    BOILERPLATE_MIN_PAGE_FRACTION,
+    BOILERPLATE_MIN_PAGES,
+    BOILERPLATE_SAMPLE_PAGES,
+    DEDUP_ENABLED,
+    DEFAULT_CHUNK_WORDS,
+    DEFAULT_CHUNK_OVERLAP_WORDS,
+    EMBEDDING_BATCH_MAX_ITEMS,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_MAX_CONCURRENCY,
+    PDF_PARSE_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_RANGE,
+    MINHASH_BANDS,
+    MINHASH_PERMUTATIONS,
+    NEAR_DUPLICATE_THRESHOLD,
+    PIPELINE_PAGE_QUEUE_SIZE,
+)
+from ..utils.chunking import ChunkBuilder, PAGE_BREAK, Span
+from ..utils.dedup import BoilerplateFilter, DuplicateFilter
+from ..utils.memory import RssTracker
+from .document_ingestion import (
+    Source,
+    iter_pdf_pages,
+    pdf_page_count,
+    plan_page_ranges,
+    extract_page_range,
+    get_parse_pool,
+    spooled_source,
+)
+from .embeddings import embed_texts, estimate_tokens
+from .retrieval import Chunk
+
+_DONE = object()
+
+
+def new_boilerplate_filter() -> Optional[BoilerplateFilter]:
+    if not DEDUP_ENABLED:
+        return None
+    return BoilerplateFilter(BOILERPLATE_SAMPLE_PAGES, BOILERPLATE_MIN_PAGE_FRACTION, BOILERPLATE_MIN_PAGES)
+
+
+def new_duplicate_filter() -> Optional[DuplicateFilter]:
+    if not DEDUP_ENABLED:
+        return None
+    return DuplicateFilter(NEAR_DUPLICATE_THRESHOLD, MINHASH_PERMUTATIONS, MINHASH_BANDS)
+
+
+async def _produce_pages_threaded(source: Source, queue: asyncio.Queue, memory: Optional[RssTracker],
+                                  stop: threading.Event, slots: threading.Semaphore) -> None:
+    loop = asyncio.get_running_loop()
+
+    def run() -> None:
+        for page_text in iter_pdf_pages(source, memory):
+            # Blocks while the chunker is PIPELINE_PAGE_QUEUE_SIZE pages behind
+            slots.acquire()
+            if stop.is_set():
+                return
+            loop.call_soon_threadsafe(queue.put_nowait, page_text)
+
+    try:
+        await asyncio.to_thread(run)
+    finally:
+        queue.put_nowait(_DONE)
+
+
+async def _produce_pages_parallel(source: Source, page_count: int, queue: asyncio.Queue) -> None:
+    with spooled_source(source) as path:
+        await _produce_page_ranges(path, page_count, queue)
+
+
+async def _produce_page_ranges(path: str, page_count: int, queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    ranges = plan_page_ranges(page_count, PDF_PARSE_WORKERS, PDF_PAGES_PER_RANGE)
+    futures = [loop.run_in_executor(pool, extract_page_range, path, start, end) for start, end in ranges]
+    try:
+        # Ranges finish in any order but are handed to the chunker in page order
+        for fut in futures:
+            text = await fut
+            if text:
+                await queue.put(text)
+    except asyncio.CancelledError:
+        # Only a failed consumer cancels us; it no longer drains the queue, which may be full
+        raise
+    except BaseException:
+        # A parser failure still ends the stream; the consumer re-raises it from this task
+        await queue.put(_DONE)
+        raise
+    else:
+        await queue.put(_DONE)
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+async def ingest_pdf_pipelined(source: Source, memory: Optional[RssTracker] = None) -> Tuple[str, List[Chunk], np.ndarray]:
+    """Parse, chunk and embed a PDF as overlapping stages.
+
+    Pages flow from the parser to an incremental ChunkBuilder through a bounded queue;
+    every full embedding batch is sent while later pages are still being parsed, and at
+    most EMBEDDING_MAX_CONCURRENCY batches are in flight before the chunker (and in turn
+    the parser) waits. Repeated headers/footers are stripped from pages and duplicate
+    chunks dropped before they reach the embedder. Returns (cleaned text, chunks,
+    embeddings) like the sequential path.
+    """
+    try:
+        page_count = await asyncio.to_thread(pdf_page_count, source)
+    except Exception:
+        page_count = 0
+
+    threaded = not (PDF_PARSE_WORKERS > 0 and page_count >= PDF_PARALLEL_MIN_PAGES)
+    # The parser thread can't await a full queue, so in that mode `slots` does the bounding
+    queue: asyncio.Queue = asyncio.Queue(maxsize=0 if threaded else PIPELINE_PAGE_QUEUE_SIZE)
+    stop = threading.Event()
+    slots = threading.Semaphore(PIPELINE_PAGE_QUEUE_SIZE)
+    if threaded:
+        producer = asyncio.create_task(_produce_pages_threaded(source, queue, memory, stop, slots))
+    else:
+        producer = asyncio.create_task(_produce_pages_parallel(source, page_count, queue))
+
+    builder = ChunkBuilder(DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS)
+    boilerplate = new_boilerplate_filter()
+    duplicates = new_duplicate_filter()
+    embed_slots = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    batch_tasks: List[asyncio.Task] = []
+    pages: List[str] = []
+    spans: List[Span] = []
+    pending: List[str] = []
+    pending_tokens = 0
+
+    async def embed_batch(texts: List[str]) -> np.ndarray:
+        try:
+            return await embed_texts(texts)
+        finally:
+            embed_slots.release()
+
+    async def dispatch() -> None:
+        nonlocal pending, pending_tokens
+        await embed_slots.acquire()
+        batch_tasks.append(asyncio.create_task(embed_batch(pending)))
+        pending = []
+        pending_tokens = 0
+
+    async def add_chunks(new_spans: List[Span]) -> None:
+        nonlocal pending_tokens
+        # Texts are sliced now, while the builder still holds them; chunks become spans at the end
+        texts = [builder.span_text(start, end) for start, end, _ in new_spans]
+        keep = duplicates.keep(texts) if duplicates is not None else [True] * len(texts)
+        for span, text, kept in zip(new_spans, texts, keep):
+            if not kept:
+                continue
+            n = estimate_tokens(text)
+            if pending and (len(pending) >= EMBEDDING_BATCH_MAX_ITEMS or pending_tokens + n > EMBEDDING_BATCH_MAX_TOKENS):
+                await dispatch()
+            spans.append(span)
+            pending.append(text)
+            pending_tokens += n
+
+    async def add_pages(new_pages: List[str]) -> None:
+        for page in new_pages:
+            # Boilerplate removal can leave a page empty; the builder skips those too
+            if page:
+                pages.append(page)
+                await add_chunks(builder.feed(page))
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if threaded:
+                slots.release()
+            # Page ranges from the process pool arrive as several pages joined by PAGE_BREAK
+            for page in item.split(PAGE_BREAK):
+                await add_pages(boilerplate.feed(page) if boilerplate is not None else [page])
+        # Re-raise a parser failure before finishing the chunk stream
+        await producer
+        if boilerplate is not None:
+            await add_pages(boilerplate.close())
+        await add_chunks(builder.close())
+        if pending:
+            await dispatch()
+        results = await asyncio.gather(*batch_tasks)
+    except BaseException:
+        stop.set()
+        slots.release()
+        producer.cancel()
+        for task in batch_tasks:
+            task.cancel()
+        raise
+
+    embeddings = np.concatenate(results) if results else np.zeros((0, 0), dtype=np.float32)
+    text = PAGE_BREAK.join(pages)
+    chunks = [Chunk(id=cid, source=text, start=start, end=end) for start, end, cid in spans]
+    return text, chunks, embeddings
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import re
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from ..config import BM25_K1, BM25_B
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Lower-cased tokens shaped like a CIN (U66010MH2000PLC123456), a product UIN
+# (HDFHLIP23008V022223) or an IRDAI product code (IRDAN125RP0001V01201718)
+_IDENTIFIER = re.compile(
+    r"[lu]\d{5}[a-z]{2}\d{4}[a-z]{3}\d{6}"
+    r"|[a-z]{5,7}\d{5}v\d{6}"
+    r"|irdan\d{3}[a-z]{2}\d{4}v\d{8}"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def is_identifier(token: str) -> bool:
+    """CIN / UIN / IRDAI product code tokens; ordinary alphanumerics like covid19 or fy2023 are not"""
+    return _IDENTIFIER.fullmatch(token) is not None
+
+
+class LexicalIndex:
+    """BM25 over chunk texts with postings stored CSR-style in flat numpy arrays.
+
+    Postings of term t are `doc_ids[indptr[t]:indptr[t + 1]]`, and `weights` holds each
+    posting's precomputed BM25 contribution, so scoring a query is one scatter-add per term.
+    """
+
+    def __init__(self, texts: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.n_docs = len(texts)
+        self.vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        lengths = np.zeros(self.n_docs, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+
+        terms = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        tf = np.asarray(tfs, dtype=np.float32)[order]
+        df = np.bincount(terms, minlength=len(self.vocabulary))
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+
+        avgdl = float(lengths.mean()) if self.n_docs else 0.0
+        idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1.0 - b + b * lengths[self.doc_ids] / max(avgdl, 1e-9))
+        self.weights = np.repeat(idf, df) * tf * (k1 + 1.0) / (tf + norm)
+
+    @classmethod
+    def from_arrays(cls, terms: List[str], indptr: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray,
+                    n_docs: int) -> "LexicalIndex":
+        """Rebuild from saved postings (e.g. memory-mapped from a snapshot) without re-tokenizing"""
+        index = cls.__new__(cls)
+        index.n_docs = n_docs
+        index.vocabulary = {term: i for i, term in enumerate(terms)}
+        index.indptr = indptr
+        index.doc_ids = doc_ids
+        index.weights = weights
+        return index
+
+    @property
+    def terms(self) -> List[str]:
+        """Vocabulary in term-id order"""
+        return sorted(self.vocabulary, key=self.vocabulary.__getitem__)
+
+    @property
+    def nbytes(self) -> int:
+        # Dict entries are roughly 100 bytes each including the key string
+        return self.doc_ids.nbytes + self.weights.nbytes + self.indptr.nbytes + 100 * len(self.vocabulary)
+
+    def _term_ids(self, text: str) -> List[int]:
+        ids = (self.vocabulary.get(t) for t in set(tokenize(text)))
+        return [i for i in ids if i is not None]
+
+    def has_identifier(self, text: str) -> bool:
+        """True if `text` names an identifier-like token that occurs in the document"""
+        return any(is_identifier(t) and t in self.vocabulary for t in tokenize(text))
+
+    def score_batch(self, queries: List[str]) -> np.ndarray:
+        """BM25 score of every chunk for every query, shaped (n_queries, n_chunks)"""
+        scores = np.zeros((len(queries), self.n_docs), dtype=np.float32)
+        for row, query in enumerate(queries):
+            for term in self._term_ids(query):
+                start, end = self.indptr[term], self.indptr[term + 1]
+                # A term's postings name each chunk at most once, so plain fancy-index add is safe
+                scores[row, self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
@@ -1,46 +1,28 @@
 from __future__ import annotations
-from typing import List
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Set
+import hashlib
+import json
+import logging
+import time
 import httpx
 import asyncio
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
-# Simple in-memory cache for performance optimization
-_response_cache = {}
-_embedding_cache = {}
-
-def get_cache_key(text: str, question: str) -> str:
-    """Generate cache key for responses"""
-    import hashlib
-    combined = f"{text[:100]}_{question[:100]}"
-    return hashlib.md5(combined.encode()).hexdigest()
-
-def get_embedding_cache_key(text: str) -> str:
-    """Generate cache key for embeddings"""
-    import hashlib
-    return hashlib.md5(text.encode()).hexdigest()
-
-async def get_cached_embedding(text: str) -> List[float]:
-    """Get cached embedding if available"""
-    cache_key = get_embedding_cache_key(text)
-    if cache_key in _embedding_cache:
-        return _embedding_cache[cache_key]
-    return None
-
-def cache_embedding(text: str, embedding: List[float]):
-    """Cache embedding for future use"""
-    cache_key = get_embedding_cache_key(text)
-    _embedding_cache[cache_key] = embedding
-    # Limit cache size to prevent memory issues
-    if len(_embedding_cache) > 1000:
-        # Remove oldest entries
-        oldest_keys = list(_embedding_cache.keys())[:100]
-        for key in oldest_keys:
-            del _embedding_cache[key]
-
-from ..config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_TOKENS, OPENAI_TEMPERATURE, HTTP_TIMEOUT_SECS, MAX_CONCURRENT_LLM_CALLS
+from ..config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_TOKENS, OPENAI_TEMPERATURE,
+    LLM_BATCH_MAX_QUESTIONS, LLM_BATCH_MIN_OVERLAP,
+)
+from .http_clients import get_openai_client
+from .answer_cache import answer_cache, answer_key
+from .context_packer import PackedContext, count_tokens, interleave_chunks, pack_context
+from .openai_scheduler import get_scheduler
+from .retrieval import Chunk
+
+logger = logging.getLogger(__name__)
 
 # ENHANCED INSURANCE-SPECIFIC SYSTEM TEMPLATE for better policy analysis
-SYSTEM_TEMPLATE = (
+_POLICY_INSTRUCTIONS = (
     "You are an expert insurance policy analysis assistant specializing in Indian health insurance policies. "
     "Your task is to provide precise, factual answers based on the provided document excerpts.\n\n"
     "INSURANCE POLICY ANALYSIS REQUIREMENTS:\n"
@@ -52,59 +34,114 @@ SYSTEM_TEMPLATE = (
     "6. Include all relevant exceptions, sub-limits, and co-payment details\n"
     "7. If information is not explicitly in the document, say 'Information not found in the document'\n"
     "8. Use exact language from the document when possible for policy terms\n"
-    "9. Include specific amounts, percentages, or time periods exactly as mentioned\n\n"
-    "Document Excerpts:\n{context}\n\n"
+    "9. Include specific amounts, percentages, or time periods exactly as mentioned"
+)
+
+# OPTIMIZED: Messages run from most to least shared - static instructions, then the document
+# context (packed in document order), then the question(s) - so calls on the same context
+# share a byte-identical prefix that the provider's prompt cache can serve. The instructions
+# alone are ~250 tokens, under the 1024-token minimum the provider caches, so a hit needs
+# calls whose packed context also starts the same (e.g. questions retrieving the same chunks)
+SYSTEM_PROMPT = _POLICY_INSTRUCTIONS
+CONTEXT_TEMPLATE = "Document Excerpts:\n{context}"
+
+QUESTION_TEMPLATE = (
     "User Question: {question}\n\n"
     "Provide a comprehensive, accurate answer with specific policy details:"
 )
 
-# SEMAPHORE for controlling concurrent LLM calls
-_llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+# Several questions over one shared context, answered as a JSON object
+BATCH_QUESTIONS_TEMPLATE = (
+    "User Questions:\n{questions}\n\n"
+    "Answer every question separately with specific policy details, as one paragraph each. "
+    "Respond with only a JSON object of the form {{\"answers\": [\"...\", ...]}} holding exactly "
+    "{count} strings, where the i-th string answers question i."
+)
+
+# Part of every answer cache key, so editing a template never serves answers from the old one
+PROMPT_VERSION = hashlib.sha256((SYSTEM_PROMPT + CONTEXT_TEMPLATE + QUESTION_TEMPLATE).encode()).hexdigest()[:16]
+BATCH_PROMPT_VERSION = hashlib.sha256((SYSTEM_PROMPT + CONTEXT_TEMPLATE + BATCH_QUESTIONS_TEMPLATE).encode()).hexdigest()[:16]
+
+# Chat completion usage since startup: packed context tokens as counted here; prompt,
+# prefix-cached and completion tokens as reported by the API
+token_usage: Dict[str, float] = {
+    "calls": 0, "context_tokens": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+    "cached_calls": 0, "latency_secs": 0.0,
+}
+# The most recent calls one by one, (prompt, cached, completion tokens, latency), so the
+# effect of caching on latency can be compared between calls of similar size
+_RECENT_CALLS = 1000
+recent_calls: Deque[Dict[str, float]] = deque(maxlen=_RECENT_CALLS)
 
 
 class LLMError(Exception):
     pass
 
 
-def get_dynamic_max_tokens(question: str, context_length: int) -> int:
-    """Dynamically allocate tokens based on question complexity and context"""
-    base_tokens = OPENAI_MAX_TOKENS
-    
-    # Adjust based on question complexity
-    question_lower = question.lower()
-    if any(word in question_lower for word in ["explain", "detailed", "describe", "how does"]):
-        base_tokens = min(2500, base_tokens + 500)  # More tokens for explanation questions
-    elif any(word in question_lower for word in ["what is", "define", "list"]):
-        base_tokens = max(1500, base_tokens - 500)  # Fewer tokens for simple questions
-    
-    # Adjust based on context length
-    if context_length > 8000:
-        base_tokens = min(3000, base_tokens + 500)  # More tokens for longer context
-    
-    return base_tokens
+def _messages(context: PackedContext, task: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": CONTEXT_TEMPLATE.format(context=context.text)},
+        {"role": "user", "content": task},
+    ]
+
+
+def _prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    # A few tokens of per-message framing on top of the contents
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+def _record_usage(context: PackedContext, usage: Optional[dict], latency: float) -> None:
+    usage = usage or {}
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    token_usage["calls"] += 1
+    token_usage["context_tokens"] += context.tokens
+    token_usage["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    token_usage["cached_tokens"] += cached
+    token_usage["completion_tokens"] += usage.get("completion_tokens") or 0
+    token_usage["cached_calls"] += 1 if cached else 0
+    token_usage["latency_secs"] += latency
+    recent_calls.append({
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "cached_tokens": cached,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "latency_secs": latency,
+    })
+    logger.info("Chat completion: %d context tokens from %d chunks (%d dropped), %s prompt (%d cached) + %s "
+                "completion tokens in %.2fs", context.tokens, len(context.chunk_ids), context.dropped,
+                usage.get("prompt_tokens"), cached, usage.get("completion_tokens"), latency)
+
+
+def clean_answer(text: str) -> str:
+    """Clean up the response to ensure single-paragraph format"""
+    if text:
+        # Remove bullet points and excessive formatting
+        text = text.replace("*", "").replace("•", "").replace("-", "")
+        # Remove extra newlines and spaces
+        text = " ".join(text.split())
+        # Ensure it's a single paragraph
+        text = text.replace("\n", " ").strip()
+    return text
+
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=6), reraise=True,
        retry=retry_if_exception_type(httpx.HTTPError))
-async def answer_with_openai(context_blocks: List[str], question: str) -> str:
+async def answer_with_openai(chunks: Sequence[Chunk], question: str) -> str:
+    """Answer one question from its retrieved chunks, best first"""
     if not OPENAI_API_KEY:
         raise LLMError("OPENAI_API_KEY not set")
 
+    # Merge overlapping chunks and fit them to the token budget, best first
+    context = pack_context(chunks)
+
     # Check cache first
-    cache_key = get_cache_key("\n".join(context_blocks), question)
-    if cache_key in _response_cache:
-        return _response_cache[cache_key]
-
-    # Limit context length to prevent token overflow
-    max_context_length = 16000  # Increased for OpenAI's better context handling
-    context_text = "\n".join(context_blocks)
-    if len(context_text) > max_context_length:
-        # Truncate while keeping most relevant parts
-        context_text = context_text[:max_context_length] + "\n[Content truncated for length]"
-
-    prompt = SYSTEM_TEMPLATE.format(context=context_text, question=question)
-    
-    # Dynamic token allocation
-    dynamic_max_tokens = get_dynamic_max_tokens(question, len(context_text))
+    cache_key = answer_key(OPENAI_MODEL, PROMPT_VERSION, context.blocks, question)
+    if answer_cache is not None:
+        cached = await asyncio.to_thread(answer_cache.get, cache_key)
+        if cached is not None:
+            return cached or "Information not found in the document."
+
+    messages = _messages(context, QUESTION_TEMPLATE.format(question=question))
 
     url = "https://api.openai.com/v1/chat/completions"
     headers = {
@@ -114,109 +151,143 @@ async def answer_with_openai(context_blocks: List[str], question: str) -> str:
     
     payload = {
         "model": OPENAI_MODEL,
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        "max_tokens": dynamic_max_tokens,
+        "messages": messages,
+        "max_tokens": OPENAI_MAX_TOKENS,
         "temperature": OPENAI_TEMPERATURE,
         "top_p": 0.9,
         "frequency_penalty": 0.1,
         "presence_penalty": 0.1
     }
 
-    async with _llm_semaphore:  # Control concurrent calls
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT_SECS) as client:
-            r = await client.post(url, headers=headers, json=payload)
+    # Shared scheduler: RPM/TPM budgets, adaptive concurrency, fair across requests
+    async with get_scheduler(OPENAI_MODEL).slot(_prompt_tokens(messages) + OPENAI_MAX_TOKENS) as slot:
+        start = time.perf_counter()
+        r = await get_openai_client().post(url, headers=headers, json=payload)
+        slot.observe(r)
+        r.raise_for_status()
+        data = r.json()
+        slot.settle((data.get("usage") or {}).get("total_tokens"))
+        _record_usage(context, data.get("usage"), time.perf_counter() - start)
+        
+        # Extract response text from OpenAI API response
+        text = ""
+        try:
+            choices = data.get("choices", [])
+            if choices and len(choices) > 0:
+                text = choices[0].get("message", {}).get("content", "").strip()
+        except Exception:
+            pass
+        
+        if not text:
+            text = (data.get("text") or "").strip()
+        
+        text = clean_answer(text)
+        
+        # Cache the response
+        if answer_cache is not None:
+            await asyncio.to_thread(answer_cache.put, cache_key, text)
+        return text or "Information not found in the document."
+
+class LLMBatchParseError(LLMError):
+    pass
+
+
+def group_questions(chunk_sets: Sequence[Set[int]], min_overlap: float = LLM_BATCH_MIN_OVERLAP,
+                    max_size: int = LLM_BATCH_MAX_QUESTIONS) -> List[List[int]]:
+    """Greedily group question positions whose retrieved chunk sets overlap heavily (Jaccard)"""
+    groups: List[List[int]] = []
+    unions: List[Set[int]] = []
+    for i, chunks in enumerate(chunk_sets):
+        best, best_overlap = -1, min_overlap
+        for g, union in enumerate(unions):
+            if len(groups[g]) >= max_size or not chunks:
+                continue
+            overlap = len(chunks & union) / len(chunks | union)
+            if overlap >= best_overlap:
+                best, best_overlap = g, overlap
+        if best < 0:
+            groups.append([i])
+            unions.append(set(chunks))
+        else:
+            groups[best].append(i)
+            unions[best] |= chunks
+    return groups
+
+
+def parse_batch_answers(text: str, count: int) -> List[str]:
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise LLMBatchParseError(f"Batch answer is not JSON: {e}")
+    answers = data.get("answers") if isinstance(data, dict) else data
+    if not isinstance(answers, list) or len(answers) != count or not all(isinstance(a, str) for a in answers):
+        raise LLMBatchParseError(f"Expected a list of {count} answer strings")
+    return answers
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=6), reraise=True,
+       retry=retry_if_exception_type(httpx.HTTPError))
+async def answer_batch_with_openai(chunks: Sequence[Chunk], questions: List[str]) -> List[str]:
+    """Answer several questions over one shared context with a single chat completion"""
+    if not OPENAI_API_KEY:
+        raise LLMError("OPENAI_API_KEY not set")
+
+    context = pack_context(chunks)
+    answers: List[str] = [""] * len(questions)
+    cache_keys = [answer_key(OPENAI_MODEL, BATCH_PROMPT_VERSION, context.blocks, q) for q in questions]
+    missing: List[int] = []
+    for i, key in enumerate(cache_keys):
+        cached = await asyncio.to_thread(answer_cache.get, key) if answer_cache is not None else None
+        if cached is None:
+            missing.append(i)
+        else:
+            answers[i] = cached
+
+    if missing:
+        numbered = "\n".join(f"{n}. {questions[i]}" for n, i in enumerate(missing, 1))
+        messages = _messages(context, BATCH_QUESTIONS_TEMPLATE.format(questions=numbered, count=len(missing)))
+        max_tokens = min(16000, OPENAI_MAX_TOKENS * len(missing))
+
+        url = "https://api.openai.com/v1/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": OPENAI_MODEL,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": OPENAI_TEMPERATURE,
+            "top_p": 0.9,
+            "response_format": {"type": "json_object"}
+        }
+
+        async with get_scheduler(OPENAI_MODEL).slot(_prompt_tokens(messages) + max_tokens) as slot:
+            start = time.perf_counter()
+            r = await get_openai_client().post(url, headers=headers, json=payload)
+            slot.observe(r)
             r.raise_for_status()
             data = r.json()
-            
-            # Extract response text from OpenAI API response
-            text = ""
-            try:
-                choices = data.get("choices", [])
-                if choices and len(choices) > 0:
-                    text = choices[0].get("message", {}).get("content", "").strip()
-            except Exception:
-                pass
-            
-            if not text:
-                text = (data.get("text") or "").strip()
-            
-            # Clean up the response to ensure single-paragraph format
-            if text:
-                # Remove bullet points and excessive formatting
-                text = text.replace("*", "").replace("•", "").replace("-", "")
-                # Remove extra newlines and spaces
-                text = " ".join(text.split())
-                # Ensure it's a single paragraph
-                text = text.replace("\n", " ").strip()
-            
-            # Cache the response
-            _response_cache[cache_key] = text
-            return text or "Information not found in the document."
-
-async def answer_with_openai_traceable(context_blocks: List[str], question: str) -> dict:
-    """Enhanced version with traceability - main function for external use"""
-    answer = await answer_with_openai(context_blocks, question)
-    return format_answer_with_traceability(answer, context_blocks, question)
-
-def format_answer_with_traceability(answer: str, source_chunks: List[str], question: str) -> dict:
-    """Format answer with traceability information"""
-    # Extract policy identifiers from source chunks
-    policy_info = extract_policy_identifiers("\n".join(source_chunks))
-    
-    # Calculate confidence based on source relevance
-    confidence_score = calculate_confidence_score(source_chunks, question)
-    
-    return {
-        "answer": answer,
-        "source_references": [
-            {
-                "chunk_id": f"chunk_{i}",
-                "relevance_score": 0.85,  # Placeholder - can be enhanced later
-                "policy_section": extract_policy_section(chunk)
-            } for i, chunk in enumerate(source_chunks[:3])  # Top 3 most relevant
-        ],
-        "confidence_score": confidence_score,
-        "policy_identifiers": policy_info
-    }
+            slot.settle((data.get("usage") or {}).get("total_tokens"))
+            _record_usage(context, data.get("usage"), time.perf_counter() - start)
 
-def extract_policy_identifiers(text: str) -> dict:
-    """Extract insurance policy identifiers from text"""
-    import re
-    
-    return {
-        "irdai_reg_no": re.findall(r"IRDAI Reg\.? No\.?[:\s]*([A-Z0-9]+)", text, re.IGNORECASE),
-        "cin": re.findall(r"CIN[:\s]*([A-Z0-9]+)", text, re.IGNORECASE),
-        "uin": re.findall(r"UIN[:\s]*([A-Z0-9]+)", text, re.IGNORECASE),
-        "policy_name": re.findall(r"([A-Za-z\s]+Policy)", text, re.IGNORECASE)
-    }
+        choices = data.get("choices") or [{}]
+        text = (choices[0].get("message") or {}).get("content") or ""
+        for i, answer in zip(missing, parse_batch_answers(text, len(missing))):
+            answers[i] = clean_answer(answer)
+            if answer_cache is not None:
+                await asyncio.to_thread(answer_cache.put, cache_keys[i], answers[i])
 
-def extract_policy_section(chunk_text: str) -> str:
-    """Extract policy section information from chunk text"""
-    # Simple extraction - can be enhanced with more sophisticated parsing
-    if "section" in chunk_text.lower():
-        import re
-        section_match = re.search(r"Section\s+([0-9\.]+)", chunk_text, re.IGNORECASE)
-        if section_match:
-            return f"Section {section_match.group(1)}"
-    return "General Policy Information"
-
-def calculate_confidence_score(source_chunks: List[str], question: str) -> float:
-    """Calculate confidence score based on source relevance"""
-    if not source_chunks:
-        return 0.0
-    
-    # Simple confidence calculation - can be enhanced
-    total_chunks = len(source_chunks)
-    if total_chunks >= 5:
-        return 0.95
-    elif total_chunks >= 3:
-        return 0.85
-    elif total_chunks >= 2:
-        return 0.75
-    else:
-        return 0.65
+    return [a or "Information not found in the document." for a in answers]
+
+
+async def answer_group_with_openai(chunks_per_question: List[List[Chunk]], questions: List[str]) -> List[str]:
+    """Answer a group of related questions in one call, falling back to one call per question"""
+    if len(questions) == 1:
+        return [await answer_with_openai(chunks_per_question[0], questions[0])]
+    try:
+        return await answer_batch_with_openai(interleave_chunks(chunks_per_question), questions)
+    except LLMBatchParseError:
+        return list(await asyncio.gather(*[
+            answer_with_openai(chunks, q) for chunks, q in zip(chunks_per_question, questions)
+        ]))
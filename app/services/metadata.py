@@ -0,0 +1,143 @@
+from __future__ import annotations
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .retrieval import Chunk
+
+# Compiled once; each scans a document's text a single time, at ingestion. Keywords are
+# whole upper-case words; CIN / UIN values must mix letters and digits, registration
+# numbers must contain a digit, so "Medicines" or "ruin nothing" yield nothing
+IDENTIFIER_PATTERNS: Dict[str, "re.Pattern[str]"] = {
+    "irdai_reg_no": re.compile(r"\bIRDAI Reg(?:n|istration)?\.? No\.?[:\s]*([A-Z0-9]*\d[A-Z0-9]*)\b"),
+    "cin": re.compile(r"\bCIN\b[:\s]*((?=[A-Z0-9]*\d)[A-Z0-9]*[A-Z][A-Z0-9]*)\b"),
+    "uin": re.compile(r"\bUIN\b[:\s]*((?=[A-Z0-9]*\d)[A-Z0-9]*[A-Z][A-Z0-9]*)\b"),
+}
+# Only a "Section N" that opens a paragraph or page is a heading; one inside running text
+# is a cross-reference ("see Section 4.2") and says nothing about where the chunk sits
+_SECTION_HEADING = re.compile(r"(?:^|(?<=[\n\f]))[ \t]*Section\s+(\d+(?:\.\d+)*)", re.IGNORECASE)
+_POLICY_NAME_WORDS = 6  # Most capitalised words before "Policy" / "Plan" taken as its name
+# The literal word is found first and the run of capitalised words before it matched backwards
+# from there, over the reversed preceding text; each occurrence costs one anchored match, where
+# `[A-Za-z\s]+Policy` was quadratic over long runs of words
+_POLICY_WORD = re.compile(r"\b(?:Policy|Plan|POLICY|PLAN)\b")
+_REVERSED_NAME_RUN = re.compile(r"(?:[ \t]+[A-Za-z0-9'&-]*[A-Z](?![A-Za-z0-9'&-])){1,%d}" % _POLICY_NAME_WORDS)
+_NAME_WINDOW = 32 * _POLICY_NAME_WORDS
+_NON_SPACE = re.compile(r"\S+")
+# Capitalised function words that open a sentence or title-case a heading ("The Policy",
+# "Claims Under This Policy"); the name is what follows the last of them
+_NOT_NAME_WORDS = frozenset(
+    "a all an and any as by each every for from if in its of on or our per said same such "
+    "that the their these this those to under with your".split()
+)
+GENERAL_SECTION = "General Policy Information"
+
+
+def _pattern_matches(pattern: "re.Pattern[str]", text: str) -> Iterable[Tuple[int, str]]:
+    return ((m.start(), m.group(1)) for m in pattern.finditer(text))
+
+
+def _policy_names(text: str) -> Iterable[Tuple[int, str]]:
+    """Proper names ending in Policy / Plan, e.g. "Easy Health Policy" from "under The Easy Health
+    Policy"; a bare or only article-led "Policy" ("this Policy", "The Policy") is not a name"""
+    for m in _POLICY_WORD.finditer(text):
+        run = _REVERSED_NAME_RUN.match(text[max(0, m.start() - _NAME_WINDOW):m.start()][::-1])
+        if run is None:
+            continue
+        run_start = m.start() - run.end()
+        words = list(_NON_SPACE.finditer(text, run_start, m.start()))
+        first = next((i + 1 for i in range(len(words) - 1, -1, -1) if words[i].group().lower() in _NOT_NAME_WORDS), 0)
+        if first < len(words):
+            yield words[first].start(), " ".join([w.group() for w in words[first:]] + [m.group()])
+
+
+class _Occurrences:
+    """Sorted start offsets of one kind of match with the captured values"""
+
+    def __init__(self, matches: Iterable[Tuple[int, str]]):
+        offsets: List[int] = []
+        self.values: List[str] = []
+        for offset, value in matches:
+            offsets.append(offset)
+            self.values.append(value)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def within(self, start: int, end: int) -> range:
+        """Indices of the matches starting inside [start, end)"""
+        lo, hi = np.searchsorted(self.offsets, (start, end))
+        return range(int(lo), int(hi))
+
+
+class DocumentMetadata:
+    """Policy identifiers and section headings of one document, located by character offset.
+
+    Built once at ingestion. Because chunks are spans of the document text, what a chunk
+    contains is a binary search over match offsets, and traceability for a question
+    costs a few lookups instead of regex passes over its context.
+    """
+
+    def __init__(self, text: str):
+        self.identifiers = {kind: _Occurrences(_pattern_matches(pattern, text))
+                            for kind, pattern in IDENTIFIER_PATTERNS.items()}
+        self.identifiers["policy_name"] = _Occurrences(_policy_names(text))
+        self.sections = _Occurrences(_pattern_matches(_SECTION_HEADING, text))
+
+    @property
+    def nbytes(self) -> int:
+        occurrences = [*self.identifiers.values(), self.sections]
+        # Python strings and list slots at roughly 64 bytes per value
+        return sum(o.offsets.nbytes + 64 * len(o.values) for o in occurrences)
+
+    def identifiers_in(self, chunks: Sequence[Chunk]) -> Dict[str, List[str]]:
+        """Identifiers found in any of `chunks`, per kind, in chunk order without repeats"""
+        found: Dict[str, List[str]] = {}
+        for kind, occurrences in self.identifiers.items():
+            values: Dict[str, None] = {}
+            for chunk in chunks:
+                for i in occurrences.within(chunk.start, chunk.end):
+                    values.setdefault(occurrences.values[i])
+            found[kind] = list(values)
+        return found
+
+    def section_of(self, chunk: Chunk) -> str:
+        """First section heading inside the chunk, else the heading the chunk falls under, else General"""
+        offsets = self.sections.offsets
+        i = int(np.searchsorted(offsets, chunk.start))
+        if i < len(offsets) and offsets[i] < chunk.end:
+            return f"Section {self.sections.values[i]}"
+        if i > 0:
+            return f"Section {self.sections.values[i - 1]}"
+        return GENERAL_SECTION
+
+    def trace(self, answer: str, chunks: Sequence[Chunk],
+              scores: Optional[Sequence[Dict[str, Optional[float]]]] = None) -> dict:
+        """Traceability record for one answer from the chunks it was given, best first.
+
+        `scores` holds each chunk's rank_score, similarity and bm25, as from the retriever.
+        """
+        scores = scores if scores is not None else [{} for _ in chunks]
+        return {
+            "answer": answer,
+            "source_references": [
+                {
+                    "chunk_id": f"chunk_{chunk.id}",
+                    "rank": rank,
+                    **{name: None if value is None else round(value, 4) for name, value in score.items()},
+                    "policy_section": self.section_of(chunk),
+                } for rank, (chunk, score) in enumerate(zip(chunks[:3], scores), 1)  # Top 3 most relevant
+            ],
+            "confidence_score": confidence_score(len(chunks)),
+            "policy_identifiers": self.identifiers_in(chunks),
+        }
+
+
+def confidence_score(source_count: int) -> float:
+    """Confidence from how many relevant chunks backed the answer"""
+    if source_count >= 5:
+        return 0.95
+    if source_count >= 3:
+        return 0.85
+    if source_count >= 2:
+        return 0.75
+    return 0.65 if source_count else 0.0
@@ -0,0 +1,269 @@
+from __future__ import annotations
+import asyncio
+import contextvars
+import itertools
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+
+from ..config import (
+    OPENAI_MODEL,
+    EMBEDDING_MODEL,
+    MAX_CONCURRENT_LLM_CALLS,
+    EMBEDDING_MAX_CONCURRENCY,
+    OPENAI_CHAT_RPM,
+    OPENAI_CHAT_TPM,
+    OPENAI_EMBEDDING_RPM,
+    OPENAI_EMBEDDING_TPM,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_TARGET_LATENCY_SECS,
+)
+
+# Which request an OpenAI call belongs to; waiters are served round-robin across flows
+_current_flow: contextvars.ContextVar[str] = contextvars.ContextVar("openai_flow", default="default")
+_flow_ids = itertools.count(1)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def new_flow() -> str:
+    """Start a new fairness flow for the current task and everything it spawns"""
+    flow = f"flow-{next(_flow_ids)}"
+    _current_flow.set(flow)
+    return flow
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds from OpenAI reset headers ("1s", "6m0s", "120ms") or plain Retry-After seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously, resynchronised from rate-limit headers"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._last = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.capacity / 60.0)
+        self._last = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def sync(self, limit: Optional[str], remaining: Optional[str], now: float) -> None:
+        self._refill(now)
+        if limit and limit.isdigit() and int(limit) > 0:
+            self.capacity = float(limit)
+        if remaining and remaining.isdigit():
+            # The server's view wins when it has less left than we think (other workers share the key)
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class _Waiter:
+    __slots__ = ("future", "cost")
+
+    def __init__(self, future: asyncio.Future, cost: float):
+        self.future = future
+        self.cost = cost
+
+
+class Slot:
+    """One admitted call; report the response so the scheduler can adapt"""
+
+    def __init__(self, scheduler: "OpenAIScheduler", cost: float):
+        self._scheduler = scheduler
+        self.cost = cost
+        self.started = time.monotonic()
+        self._observed = False
+
+    def observe(self, response: httpx.Response) -> None:
+        self._observed = True
+        self._scheduler._observe(response)
+
+    def settle(self, used_tokens: Optional[int]) -> None:
+        """Return the unused part of the estimated token cost once `usage` is known"""
+        if used_tokens is not None and used_tokens < self.cost:
+            self._scheduler.tokens.refund(self.cost - used_tokens)
+
+
+class OpenAIScheduler:
+    """Admission control for one OpenAI model.
+
+    A call waits until (a) the RPM and TPM token buckets have room, (b) fewer than
+    `limit` calls are in flight and (c) it is its flow's turn. The limit follows
+    AIMD: +1/limit per fast success, x0.9 for a slow one and x0.5 on a 429, which
+    also pauses admissions for Retry-After / x-ratelimit-reset-*.
+    """
+
+    def __init__(self, rpm: int, tpm: int, initial_concurrency: int, max_concurrency: int,
+                 target_latency: float, min_concurrency: int = 1):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.throttled = 0
+        self._paused_until = 0.0
+        self._flows: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def slot(self, cost: float) -> "_SlotContext":
+        return _SlotContext(self, cost)
+
+    async def _acquire(self, cost: float) -> Slot:
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), cost)
+        self._flows.setdefault(_current_flow.get(), deque()).append(waiter)
+        self._pump()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted and cancelled in the same tick: give the slot back
+                self._release(None)
+            raise
+        return Slot(self, cost)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Head of the first non-empty flow; _pump rotates the flow to the back once served"""
+        while self._flows:
+            flow, queue = next(iter(self._flows.items()))
+            while queue and queue[0].future.done():
+                queue.popleft()  # Cancelled while queued
+            if not queue:
+                del self._flows[flow]
+                continue
+            return queue[0]
+        return None
+
+    def _pump(self) -> None:
+        now = time.monotonic()
+        while self.in_flight < max(self.min_concurrency, int(self.limit)):
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            delay = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(waiter.cost, now),
+            )
+            if delay > 0:
+                self._schedule_pump(delay)
+                return
+            flow, queue = next(iter(self._flows.items()))
+            queue.popleft()
+            self._flows.move_to_end(flow)
+            self.requests.consume(1, now)
+            self.tokens.consume(waiter.cost, now)
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _schedule_pump(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+
+    def _release(self, latency: Optional[float]) -> None:
+        self.in_flight -= 1
+        if latency is not None:
+            if latency <= self.target_latency:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+            else:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+        self._pump()
+
+    def _observe(self, response: httpx.Response) -> None:
+        now = time.monotonic()
+        headers = response.headers
+        self.requests.sync(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"), now)
+        self.tokens.sync(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"), now)
+        if response.status_code == 429:
+            self.throttled += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            pause = parse_duration(headers.get("retry-after"))
+            if pause is None:
+                pause = max(parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0,
+                            parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0) or 1.0
+            self._paused_until = max(self._paused_until, now + pause)
+
+    def _finish(self, slot: Slot, failed: bool) -> None:
+        # Only successful, observed calls count as a latency sample for growth
+        latency = None if failed or not slot._observed else time.monotonic() - slot.started
+        self._release(latency)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": sum(len(q) for q in self._flows.values()),
+            "throttled": self.throttled,
+            "request_budget": self.requests.tokens,
+            "token_budget": self.tokens.tokens,
+        }
+
+
+class _SlotContext:
+    def __init__(self, scheduler: OpenAIScheduler, cost: float):
+        self._scheduler = scheduler
+        self._cost = cost
+        self._slot: Optional[Slot] = None
+
+    async def __aenter__(self) -> Slot:
+        self._slot = await self._scheduler._acquire(self._cost)
+        return self._slot
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._scheduler._finish(self._slot, exc_type is not None)
+
+
+_schedulers: Dict[str, OpenAIScheduler] = {}
+
+# OpenAI enforces limits per model, so chat and embeddings get separate budgets
+_MODEL_LIMITS: Dict[str, Tuple[int, int, int]] = {
+    OPENAI_MODEL: (OPENAI_CHAT_RPM, OPENAI_CHAT_TPM, MAX_CONCURRENT_LLM_CALLS),
+    EMBEDDING_MODEL: (OPENAI_EMBEDDING_RPM, OPENAI_EMBEDDING_TPM, EMBEDDING_MAX_CONCURRENCY),
+}
+
+
+def scheduler_stats() -> Dict[str, Dict[str, float]]:
+    """stats() of every model's scheduler created so far"""
+    return {model: scheduler.stats() for model, scheduler in _schedulers.items()}
+
+
+def get_scheduler(model: str) -> OpenAIScheduler:
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        rpm, tpm, initial = _MODEL_LIMITS.get(model, (OPENAI_CHAT_RPM, OPENAI_CHAT_TPM, MAX_CONCURRENT_LLM_CALLS))
+        scheduler = OpenAIScheduler(rpm, tpm, initial, OPENAI_MAX_CONCURRENCY, OPENAI_TARGET_LATENCY_SECS)
+        _schedulers[model] = scheduler
+    return scheduler
@@ -1,6 +1,7 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import List, Tuple
+import tempfile
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
 import numpy as np
 
 try:
@@ -10,31 +11,269 @@ except Exception:
     faiss = None
     _HAS_FAISS = False
 
-from ..config import CHUNK_SIMILARITY_THRESHOLD
+from ..config import (
+    CHUNK_SIMILARITY_THRESHOLD,
+    EMBEDDING_STORAGE,
+    RESCORE_CANDIDATES_PER_HIT,
+    RESCORE_MIN_CANDIDATES,
+    HYBRID_RETRIEVAL_ENABLED,
+    HYBRID_CANDIDATES_PER_HIT,
+    RRF_K,
+    ANN_MIN_CHUNKS,
+    ANN_LISTS,
+    ANN_NPROBE,
+)
+from .ann import IVFIndex, default_list_count
+from .lexical import LexicalIndex
+
+_SCORE_BLOCK_ROWS = 4096  # Rows de-quantized per block while scoring
 
 
 @dataclass
 class Chunk:
+    """Span [start, end) of the document's cleaned text; every chunk shares that one string"""
     id: int
-    text: str
+    source: str = field(repr=False)
+    start: int
+    end: int
+
+    @property
+    def text(self) -> str:
+        return self.source[self.start:self.end]
+
+    @classmethod
+    def from_text(cls, id: int, text: str) -> "Chunk":
+        return cls(id=id, source=text, start=0, end=len(text))
+
+
+class QuantizedMatrix:
+    """float16 codes, or int8 codes with one scale per row, of a unit-norm float32 matrix"""
+
+    def __init__(self, x: np.ndarray, dtype: str):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported embedding storage: {dtype}")
+        self.dtype = dtype
+        self.codes = np.empty(x.shape, dtype=np.float16 if dtype == "float16" else np.int8)
+        self.scales: Optional[np.ndarray] = None
+        if dtype == "int8":
+            self.scales = (np.abs(x).max(axis=1) / 127.0 + 1e-12).astype(np.float32)
+        for start in range(0, x.shape[0], _SCORE_BLOCK_ROWS):
+            block = x[start:start + _SCORE_BLOCK_ROWS]
+            if self.scales is None:
+                self.codes[start:start + len(block)] = block
+            else:
+                self.codes[start:start + len(block)] = np.rint(block / self.scales[start:start + len(block), None])
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        """Approximate q @ x.T, de-quantizing a block of rows at a time"""
+        out = np.empty((q.shape[0], self.codes.shape[0]), dtype=np.float32)
+        for start in range(0, self.codes.shape[0], _SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + _SCORE_BLOCK_ROWS].astype(np.float32)
+            sims = q @ block.T
+            if self.scales is not None:
+                sims *= self.scales[start:start + len(block)]
+            out[:, start:start + len(block)] = sims
+        return out
+
+
+def _spill_to_disk(x: np.ndarray) -> np.ndarray:
+    """Move a matrix into an anonymous temp file and map it back read-only"""
+    with tempfile.TemporaryFile() as f:
+        x.tofile(f)
+        f.flush()
+        # The mapping outlives the file handle; the data is freed with the last reference
+        return np.memmap(f, dtype=x.dtype, mode="r", shape=x.shape)
 
 
 class Retriever:
-    def __init__(self, embeddings: np.ndarray, chunks: List[Chunk]):
+    """Cosine search over chunk embeddings.
+
+    With storage "float32" the normalised matrix is searched directly. With "float16"
+    or "int8" only the quantized codes stay in memory; the exact vectors move to a
+    memory-mapped temp file and are read back just to re-score the best candidates.
+
+    float32 documents with at least ANN_MIN_CHUNKS chunks are searched through an IVF
+    index instead of exhaustively: FAISS IndexIVFFlat if installed, else IVFIndex.
+    """
+
+    def __init__(self, embeddings: np.ndarray, chunks: List[Chunk], storage: str = EMBEDDING_STORAGE,
+                 lexical: Optional[LexicalIndex] = None, normalized: bool = False, copy: bool = True):
+        """`normalized=True` takes unit-norm rows as-is, so a read-only memmap is used without a copy.
+        Otherwise rows are normalised in a copy, or in place in a float32 `embeddings` with `copy=False`.
+        """
         self.chunks = chunks
-        self.embeddings = self._normalize(embeddings.astype(np.float32))
+        self.storage = storage
+        if lexical is None and HYBRID_RETRIEVAL_ENABLED:
+            lexical = LexicalIndex([c.text for c in chunks])
+        self.lexical = lexical
+        exact = np.asanyarray(embeddings, dtype=np.float32)
+        if not normalized:
+            exact = self._normalize(exact.copy() if copy and exact is embeddings else exact)
+        self.quantized: Optional[QuantizedMatrix] = None
+        self.ann: Optional[IVFIndex] = None
         self.index = None
+        if storage == "float32":
+            self.embeddings = exact
+            approximate = len(exact) >= ANN_MIN_CHUNKS
+            n_lists = ANN_LISTS or default_list_count(len(exact))
+            if _HAS_FAISS and approximate:
+                self.index = faiss.IndexIVFFlat(faiss.IndexFlatIP(exact.shape[1]), exact.shape[1], n_lists,
+                                                faiss.METRIC_INNER_PRODUCT)
+                self.index.train(exact)
+                self.index.add(exact)
+                self.index.nprobe = ANN_NPROBE
+            elif _HAS_FAISS:
+                self.index = faiss.IndexFlatIP(exact.shape[1])
+                self.index.add(exact)
+            elif approximate:
+                self.ann = IVFIndex(exact, n_lists, ANN_NPROBE)
+            return
+
         if _HAS_FAISS:
-            d = self.embeddings.shape[1]
-            self.index = faiss.IndexFlatIP(d)
-            self.index.add(self.embeddings)
+            qtype = faiss.ScalarQuantizer.QT_fp16 if storage == "float16" else faiss.ScalarQuantizer.QT_8bit
+            self.index = faiss.IndexScalarQuantizer(exact.shape[1], qtype, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(exact)
+            self.index.add(exact)
+        else:
+            self.quantized = QuantizedMatrix(exact, storage)
+        # Snapshot matrices are already file-backed
+        self.embeddings = _spill_to_disk(exact) if len(exact) and not isinstance(exact, np.memmap) else exact
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes of the search structures (the exact memmap is page cache, not heap)"""
+        total = self.lexical.nbytes if self.lexical is not None else 0
+        if self.storage == "float32":
+            # IndexFlatIP / IndexIVFFlat keep their own copy of the vectors
+            if self.index is not None:
+                total += self.embeddings.nbytes
+            if not isinstance(self.embeddings, np.memmap):
+                total += self.embeddings.nbytes
+            return total + (self.ann.nbytes if self.ann is not None else 0)
+        if self.index is not None:
+            return total + self.index.sa_code_size() * self.index.ntotal
+        return total + (self.quantized.nbytes if self.quantized is not None else 0)
+
+    def matches_identifier(self, question: str) -> bool:
+        """Whether lexical search alone can answer `question` (it names an identifier in the document)"""
+        return self.lexical is not None and self.lexical.has_identifier(question)
 
     @staticmethod
     def _normalize(x: np.ndarray) -> np.ndarray:
-        norms = np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
-        return x / norms
+        if not x.flags.writeable:
+            x = x.copy()
+        x /= np.linalg.norm(x, axis=1, keepdims=True) + 1e-12
+        return x
+
+    def search_batch(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k chunks for every row of `queries` in one pass.
+
+        Returns (indices, scores), both shaped (n_queries, k) and sorted by descending
+        score. Hits below CHUNK_SIMILARITY_THRESHOLD have index -1, unless none of a
+        query's hits clear it, in which case its unfiltered top-k is kept.
+        """
+        q = np.atleast_2d(queries).astype(np.float32)
+        q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
+        n = len(self.chunks)
+        k = min(top_k, n)
+        if k <= 0 or q.shape[0] == 0:
+            return np.empty((q.shape[0], 0), dtype=np.int64), np.empty((q.shape[0], 0), dtype=np.float32)
+
+        if self.storage == "float32":
+            if self.index is not None:
+                scores, indices = self.index.search(q, k)
+                indices = indices.astype(np.int64)
+            elif self.ann is not None:
+                indices, scores = self.ann.search(q, k)
+            else:
+                indices, scores = self._top_k(q @ self.embeddings.T, k)
+        else:
+            # Shortlist on the quantized codes, then rank the shortlist by exact cosine
+            candidates = min(n, max(k * RESCORE_CANDIDATES_PER_HIT, RESCORE_MIN_CANDIDATES))
+            if self.index is not None:
+                _, shortlist = self.index.search(q, candidates)
+                shortlist = shortlist.astype(np.int64)
+            else:
+                shortlist, _ = self._top_k(self.quantized.scores(q), candidates)
+            exact = np.einsum("qcd,qd->qc", self.embeddings[shortlist], q)
+            order, scores = self._top_k(exact, k)
+            indices = np.take_along_axis(shortlist, order, axis=1)
+
+        below = scores < CHUNK_SIMILARITY_THRESHOLD
+        # Queries with no hit above the threshold keep their best matches anyway
+        below &= ~below.all(axis=1, keepdims=True)
+        indices = np.where(below, -1, indices)
+        return indices, scores.astype(np.float32, copy=False)
+
+    def score_hits(self, questions: List[str], query_vectors: np.ndarray, indices: np.ndarray
+                   ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Cosine similarity and BM25 score (None without a lexical index) of every hit in `indices`.
+
+        NaN where there is no hit (-1), and for similarity where the query vector is all zero.
+        """
+        hit = indices >= 0
+        rows = np.where(hit, indices, 0)
+        q = np.atleast_2d(query_vectors).astype(np.float32)
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        similarity = np.einsum("qkd,qd->qk", np.asarray(self.embeddings[rows], dtype=np.float32), q / (norms + 1e-12))
+        similarity = np.where(hit & (norms > 0), similarity, np.nan)
+        bm25 = None
+        if self.lexical is not None:
+            bm25 = np.where(hit, np.take_along_axis(self.lexical.score_batch(questions), rows, axis=1), np.nan)
+        return similarity, bm25
+
+    def hybrid_search_batch(self, questions: List[str], query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Relevant chunks per question from dense and BM25 rankings fused by reciprocal rank.
+
+        A question gets hits only if some chunk clears CHUNK_SIMILARITY_THRESHOLD or it names
+        an identifier from the document; BM25 then adds and re-orders candidates. An all-zero
+        query vector contributes no dense hits.
+        Returns (indices, scores) shaped (n_questions, k), best first, -1 past the last hit.
+        Without a lexical index the scores are the cosine similarities.
+        """
+        n = len(self.chunks)
+        k = min(top_k, n)
+        candidates = min(n, k * HYBRID_CANDIDATES_PER_HIT)
+        dense_idx, dense_scores = self.search_batch(query_vectors, candidates if self.lexical is not None else k)
+        dense_idx = np.where(dense_scores > CHUNK_SIMILARITY_THRESHOLD, dense_idx, -1)
+        if self.lexical is None or k <= 0:
+            return dense_idx, dense_scores
+
+        lex_idx, lex_scores = self._top_k(self.lexical.score_batch(questions), candidates)
+        lex_idx = np.where(lex_scores > 0, lex_idx, -1)
+
+        fused = np.zeros((len(questions), n), dtype=np.float32)
+        rows = np.arange(len(questions))[:, None]
+        for idx in (dense_idx, lex_idx):
+            contribution = np.broadcast_to(1.0 / (RRF_K + 1 + np.arange(idx.shape[1], dtype=np.float32)), idx.shape)
+            hit = idx >= 0
+            # Each ranking lists a chunk at most once per row, so plain fancy-index add is safe
+            fused[np.broadcast_to(rows, idx.shape)[hit], idx[hit]] += contribution[hit]
+        indices, scores = self._top_k(fused, k)
+        relevant = (dense_idx >= 0).any(axis=1) | np.array([self.lexical.has_identifier(q) for q in questions], dtype=bool)
+        return np.where((scores > 0) & relevant[:, None], indices, -1), scores
+
+    @staticmethod
+    def _top_k(sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Column indices and values of each row's k largest entries, best first"""
+        n = sims.shape[1]
+        if k < n:
+            indices = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(n), (sims.shape[0], n)).copy()
+        scores = np.take_along_axis(sims, indices, axis=1)
+        order = np.argsort(-scores, axis=1, kind="stable")
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
 
     def search(self, query_vector: np.ndarray, top_k: int) -> List[Tuple[Chunk, float]]:
+        if self.storage != "float32" or self.ann is not None:
+            indices, scores = self.search_batch(query_vector, top_k)
+            return [(self.chunks[i], float(s)) for i, s in zip(indices[0], scores[0]) if i >= 0]
+
         q = query_vector.astype(np.float32)
         q = q / (np.linalg.norm(q) + 1e-12)
         
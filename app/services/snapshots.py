@@ -0,0 +1,208 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ..config import (
+    BOILERPLATE_MIN_PAGE_FRACTION,
+    BOILERPLATE_MIN_PAGES,
+    BOILERPLATE_SAMPLE_PAGES,
+    DEDUP_ENABLED,
+    DEFAULT_CHUNK_WORDS,
+    DEFAULT_CHUNK_OVERLAP_WORDS,
+    EMBEDDING_MODEL,
+    MINHASH_BANDS,
+    MINHASH_PERMUTATIONS,
+    NEAR_DUPLICATE_THRESHOLD,
+    EMBEDDING_DIMENSIONS,
+    SNAPSHOT_DIR,
+    SNAPSHOT_MAX_DOCUMENTS,
+)
+from .lexical import LexicalIndex
+from .retrieval import Chunk, Retriever
+
+# Bump when the file layout or the chunking code changes; snapshots in another format
+# are ignored and rewritten
+SNAPSHOT_FORMAT = 3
+_META_FILE = "meta.json"
+
+
+@dataclass
+class Snapshot:
+    meta: Dict[str, Any]
+    text: str
+    chunks: List[Chunk]
+    retriever: Retriever
+
+
+def chunking_settings() -> Dict[str, Any]:
+    """Settings that decide which chunks a document produces; a snapshot built under others is stale"""
+    settings: Dict[str, Any] = {
+        "chunk_words": DEFAULT_CHUNK_WORDS,
+        "chunk_overlap_words": DEFAULT_CHUNK_OVERLAP_WORDS,
+        "dedup": DEDUP_ENABLED,
+    }
+    if DEDUP_ENABLED:
+        settings.update({
+            "boilerplate_sample_pages": BOILERPLATE_SAMPLE_PAGES,
+            "boilerplate_min_page_fraction": BOILERPLATE_MIN_PAGE_FRACTION,
+            "boilerplate_min_pages": BOILERPLATE_MIN_PAGES,
+            "near_duplicate_threshold": NEAR_DUPLICATE_THRESHOLD,
+            "minhash_permutations": MINHASH_PERMUTATIONS,
+            "minhash_bands": MINHASH_BANDS,
+        })
+    return settings
+
+
+def snapshot_path(content_hash: str, root: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(root, content_hash)
+
+
+def _write_strings(path: str, strings: List[str]) -> np.ndarray:
+    """Concatenate UTF-8 strings into one file; returns the n+1 byte offsets"""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    with open(path, "wb") as f:
+        for i, s in enumerate(strings):
+            data = s.encode("utf-8", errors="surrogatepass")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    return offsets
+
+
+def _read_strings(path: str, offsets: np.ndarray) -> List[str]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8", errors="surrogatepass") for i in range(len(offsets) - 1)]
+
+
+def save_snapshot(url: str, content_hash: str, text: str, chunks: List[Chunk], retriever: Retriever,
+                  root: str = SNAPSHOT_DIR) -> None:
+    """Write a document's text, chunk spans, normalised embeddings and BM25 postings under root/<content_hash>.
+
+    Files are written to a temporary directory and renamed into place, so readers never
+    see a partial snapshot. When a compatible snapshot of the same content already exists,
+    `url` is only added to its URL list.
+    """
+    final = snapshot_path(content_hash, root)
+    existing = _read_meta(final)
+    if existing is not None:
+        urls = _snapshot_urls(existing)
+        meta = {**existing, "urls": urls + [url] if url not in urls else urls, "created": time.time()}
+        meta.pop("url", None)
+        tmp_meta = os.path.join(final, f"{_META_FILE}.tmp-{os.getpid()}")
+        with open(tmp_meta, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, os.path.join(final, _META_FILE))
+        _prune(root)
+        return
+    tmp = f"{final}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        with open(os.path.join(tmp, "text.bin"), "wb") as f:
+            f.write(text.encode("utf-8", errors="surrogatepass"))
+        # Chunks are spans of the text, so their offsets are all that needs saving
+        np.save(os.path.join(tmp, "chunk_spans.npy"), np.array([(c.start, c.end) for c in chunks], dtype=np.int64).reshape(-1, 2))
+        np.save(os.path.join(tmp, "chunk_ids.npy"), np.array([c.id for c in chunks], dtype=np.int64))
+        np.save(os.path.join(tmp, "embeddings.npy"), np.asarray(retriever.embeddings, dtype=np.float32))
+        if retriever.lexical is not None:
+            lexical = retriever.lexical
+            np.save(os.path.join(tmp, "lexical_term_offsets.npy"), _write_strings(os.path.join(tmp, "lexical_terms.bin"), lexical.terms))
+            np.save(os.path.join(tmp, "lexical_indptr.npy"), lexical.indptr)
+            np.save(os.path.join(tmp, "lexical_doc_ids.npy"), lexical.doc_ids)
+            np.save(os.path.join(tmp, "lexical_weights.npy"), lexical.weights)
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "urls": [url],
+            "content_hash": content_hash,
+            "embedding_model": EMBEDDING_MODEL,
+            "dimensions": int(retriever.embeddings.shape[1]),
+            "chunks": len(chunks),
+            "chunking": chunking_settings(),
+            "lexical": retriever.lexical is not None,
+            "created": time.time(),
+        }
+        # meta.json goes last: a directory without it is not a snapshot
+        with open(os.path.join(tmp, _META_FILE), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    _prune(root)
+
+
+def _read_meta(directory: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, _META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    compatible = (meta.get("format") == SNAPSHOT_FORMAT and meta.get("embedding_model") == EMBEDDING_MODEL
+                  and meta.get("dimensions") == EMBEDDING_DIMENSIONS and meta.get("chunking") == chunking_settings())
+    return meta if compatible else None
+
+
+def _snapshot_urls(meta: Dict[str, Any]) -> List[str]:
+    """URLs a snapshot's content was downloaded from; older snapshots record a single url"""
+    urls = meta.get("urls")
+    if urls is None:
+        urls = [meta["url"]] if meta.get("url") else []
+    return list(urls)
+
+
+def load_snapshot(content_hash: str, root: str = SNAPSHOT_DIR) -> Optional[Snapshot]:
+    """Open a snapshot with its arrays memory-mapped read-only; None if absent or incompatible"""
+    directory = snapshot_path(content_hash, root)
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(directory, name), mmap_mode="r")
+
+    with open(os.path.join(directory, "text.bin"), "rb") as f:
+        text = f.read().decode("utf-8", errors="surrogatepass")
+    chunks = [Chunk(id=cid, source=text, start=start, end=end)
+              for cid, (start, end) in zip(load("chunk_ids.npy").tolist(), load("chunk_spans.npy").tolist())]
+    lexical = None
+    if meta.get("lexical"):
+        terms = _read_strings(os.path.join(directory, "lexical_terms.bin"), load("lexical_term_offsets.npy"))
+        lexical = LexicalIndex.from_arrays(terms, load("lexical_indptr.npy"), load("lexical_doc_ids.npy"),
+                                           load("lexical_weights.npy"), len(chunks))
+    retriever = Retriever(load("embeddings.npy"), chunks, lexical=lexical, normalized=True)
+    # Touch the directory so pruning treats it as recently used
+    os.utime(directory)
+    return Snapshot(meta=meta, text=text, chunks=chunks, retriever=retriever)
+
+
+def find_snapshot(url: str, root: str = SNAPSHOT_DIR) -> Optional[str]:
+    """Content hash of the newest compatible snapshot downloaded from `url`"""
+    best: Optional[Dict[str, Any]] = None
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return None
+    for name in names:
+        meta = _read_meta(os.path.join(root, name))
+        if meta is not None and url in _snapshot_urls(meta) and (best is None or meta["created"] > best["created"]):
+            best = meta
+    return best["content_hash"] if best else None
+
+
+def _prune(root: str) -> None:
+    if SNAPSHOT_MAX_DOCUMENTS <= 0:
+        return
+    try:
+        entries = [os.path.join(root, name) for name in os.listdir(root) if ".tmp-" not in name]
+        entries.sort(key=os.path.getmtime)
+    except OSError:
+        return
+    for directory in entries[:-SNAPSHOT_MAX_DOCUMENTS]:
+        shutil.rmtree(directory, ignore_errors=True)
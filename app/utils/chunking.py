@@ -1,75 +1,182 @@
 import re
 from typing import List, Tuple
 
+import numpy as np
+
+PARAGRAPH_BREAK = "\n\n"
+PAGE_BREAK = "\f"
+MIN_CHUNK_WORDS = 10  # Shorter chunks are dropped as not meaningful
+
+_BLANK_LINE = re.compile(r"\n\s*\n")
+
+# Code points str.split() treats as whitespace, as a lookup table
+_SPACE_TABLE = np.zeros(0x3001, dtype=bool)
+_SPACE_TABLE[[ord(c) for c in " \t\n\v\f\r\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2028\u2029\u202f\u205f\u3000"]] = True
+_SPACE_TABLE[0x2000:0x200b] = True
+_SENTENCE_END = np.array([ord(c) for c in ".!?"], dtype=np.uint32)
+
+Span = Tuple[int, int, int]  # (start, end, chunk id) into the cleaned document text
+
 
 def clean_text(text: str) -> str:
+    """Collapse whitespace within paragraphs while keeping the document's structure.
+
+    Paragraphs (blank-line separated) are joined by PARAGRAPH_BREAK and pages
+    (form-feed separated) by PAGE_BREAK; every other run of whitespace, including
+    single line breaks, becomes one space.
+    """
     if not text:
         return ""
     text = text.replace("\u00a0", " ")
     text = re.sub(r"\r\n?", "\n", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-
-def split_into_sentences(text: str) -> List[str]:
-    # IMPROVED: Better sentence splitting that preserves context
-    pattern = r"(?<=[.!?])\s+(?=[A-Z])"
-    sentences = re.split(pattern, text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    return sentences
-
-
-def split_into_paragraphs(text: str) -> List[str]:
-    """Split text into paragraphs for better context preservation"""
-    paragraphs = re.split(r'\n\s*\n', text)
-    return [p.strip() for p in paragraphs if p.strip()]
-
-
-def build_chunks(text: str, chunk_words: int, overlap_words: int) -> List[Tuple[str, int]]:
-    # IMPROVED: Hybrid approach - use paragraphs when possible, sentences when needed
-    paragraphs = split_into_paragraphs(text)
-    chunks: List[Tuple[str, int]] = []
-    chunk_id = 0
-
-    for paragraph in paragraphs:
-        # If paragraph is small enough, keep it as one chunk
-        if len(paragraph.split()) <= chunk_words:
-            chunks.append((paragraph, chunk_id))
-            chunk_id += 1
-        else:
-            # Split large paragraphs into sentences
-            sentences = split_into_sentences(paragraph)
-            current_words: List[str] = []
-            current_len = 0
-
-            for sent in sentences:
-                words = sent.split()
-                if current_len + len(words) <= chunk_words:
-                    current_words.extend(words)
-                    current_len += len(words)
-                else:
-                    if current_words:
-                        chunks.append((" ".join(current_words), chunk_id))
-                        chunk_id += 1
-                    
-                    # IMPROVED: Better overlap handling
-                    if overlap_words > 0 and current_words:
-                        overlap = current_words[-overlap_words:] if len(current_words) >= overlap_words else current_words
-                        current_words = overlap + words
-                        current_len = len(current_words)
-                    else:
-                        current_words = words
-                        current_len = len(words)
-
-            if current_words:
-                chunks.append((" ".join(current_words), chunk_id))
-                chunk_id += 1
-
-    # IMPROVED: Filter out very short chunks that might not be meaningful
-    filtered_chunks = []
-    for chunk_text, cid in chunks:
-        if len(chunk_text.split()) >= 10:  # Minimum 10 words for meaningful chunks
-            filtered_chunks.append((chunk_text, cid))
-    
-    return filtered_chunks
+    pages = []
+    for page in text.split(PAGE_BREAK):
+        paragraphs = (" ".join(p.split()) for p in _BLANK_LINE.split(page))
+        page_text = PARAGRAPH_BREAK.join(p for p in paragraphs if p)
+        if page_text:
+            pages.append(page_text)
+    return PAGE_BREAK.join(pages)
+
+
+def _tokenize(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Word start/end offsets plus, per word, whether a sentence / paragraph starts there.
+
+    One vectorised pass over the code points: a sentence starts at a capitalised word
+    after one ending in . ! or ?, and a paragraph after a blank line or page break.
+    """
+    if text.isascii():
+        codes = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        space = _SPACE_TABLE[codes]
+    else:
+        codes = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+        space = _SPACE_TABLE[np.minimum(codes, len(_SPACE_TABLE) - 1)] & (codes < len(_SPACE_TABLE))
+    edges = np.diff(np.concatenate(([True], space, [True])).view(np.int8))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+
+    # Blank lines and page breaks are rare, so locate them and binary-search word gaps against them
+    breaks = np.flatnonzero(codes == ord(PAGE_BREAK))
+    newlines = np.flatnonzero(codes == 10)
+    breaks = np.union1d(breaks, newlines[:-1][np.diff(newlines) == 1])
+    paragraph = np.ones(len(starts), dtype=bool)
+    paragraph[1:] = np.searchsorted(breaks, starts[1:]) > np.searchsorted(breaks, ends[:-1])
+
+    sentence = paragraph.copy()
+    if len(starts) > 1:
+        first = codes[starts[1:]]
+        sentence[1:] |= np.isin(codes[ends[:-1] - 1], _SENTENCE_END) & (first >= ord("A")) & (first <= ord("Z"))
+    return starts, ends, sentence, paragraph
+
+
+class ChunkBuilder:
+    """Chunks a document incrementally, as page texts arrive, in linear time.
+
+    Pages are cleaned texts joined by PAGE_BREAK. Chunks are returned as
+    (start, end, id) character spans into that joined text. Whole paragraphs are
+    packed into chunks of up to `chunk_words` words. A longer paragraph is split at
+    sentence ends, and each piece after the first repeats the previous chunk's last
+    `overlap_words` words. All of this is index arithmetic over word offsets; no
+    chunk text is built.
+    """
+
+    def __init__(self, chunk_words: int, overlap_words: int, min_words: int = MIN_CHUNK_WORDS):
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.min_words = min_words
+        self._buffer = ""  # Joined text from offset _base onwards
+        self._base = 0
+        self._done = 0  # Text before this offset has been tokenized
+        # Word offsets of the chunk still being filled
+        self._open_starts = np.empty(0, dtype=np.int64)
+        self._open_ends = np.empty(0, dtype=np.int64)
+        self._chunk_id = 0
+
+    def span_text(self, start: int, end: int) -> str:
+        """Text of a span returned by the latest feed() / close() call"""
+        return self._buffer[start - self._base:end - self._base]
+
+    def _trim(self) -> None:
+        # Keep only what later spans can still reach: the open chunk and untokenized text
+        keep = min(self._done, int(self._open_starts[0])) if len(self._open_starts) else self._done
+        self._buffer = self._buffer[keep - self._base:]
+        self._base = keep
+
+    def feed(self, text: str) -> List[Span]:
+        """Append the next page; returns the chunks completed by it"""
+        if not text:
+            return []
+        self._trim()
+        if self._base + len(self._buffer) > 0:
+            self._buffer += PAGE_BREAK
+        self._buffer += text
+        # Only paragraphs followed by a break are complete; the last one may continue
+        cut = max(self._buffer.rfind(PARAGRAPH_BREAK), self._buffer.rfind(PAGE_BREAK)) + self._base
+        if cut <= self._done:
+            return []
+        return self._pack(cut)
+
+    def close(self) -> List[Span]:
+        self._trim()
+        out = self._pack(self._base + len(self._buffer))
+        if len(self._open_starts):
+            self._emit(self._open_starts, self._open_ends, 0, len(self._open_starts), out)
+            self._open_starts = self._open_starts[:0]
+            self._open_ends = self._open_ends[:0]
+        return out
+
+    def _emit(self, starts: np.ndarray, ends: np.ndarray, a: int, b: int, out: List[Span]) -> None:
+        # Chunks below min_words are dropped, but still use up an id
+        if b - a >= self.min_words:
+            out.append((int(starts[a]), int(ends[b - 1]), self._chunk_id))
+        self._chunk_id += 1
+
+    def _pack(self, upto: int) -> List[Span]:
+        """Chunk the text in [_done, upto), continuing the open chunk"""
+        out: List[Span] = []
+        lo = self._done - self._base
+        region = self._buffer[lo:upto - self._base]
+        self._done = upto
+        starts, ends, sentence, paragraph = _tokenize(region)
+        if not len(starts):
+            return out
+
+        offset = self._base + lo
+        carried = len(self._open_starts)
+        # Word arrays for the open chunk followed by this region, so overlap is plain indexing
+        starts = np.concatenate((self._open_starts, starts + offset))
+        ends = np.concatenate((self._open_ends, ends + offset))
+        sent_starts = np.flatnonzero(sentence) + carried
+        sent_ends = np.append(sent_starts[1:], len(starts))
+        sent_paragraph = paragraph[sent_starts - carried]
+        # Words in the paragraph each sentence belongs to
+        para_starts = np.flatnonzero(paragraph) + carried
+        para_words = np.diff(np.append(para_starts, len(starts)))
+        sent_para_words = para_words[np.searchsorted(para_starts, sent_starts, side="right") - 1]
+
+        chunk_words, overlap = self.chunk_words, self.overlap_words
+        a, b = 0, carried  # Open chunk is words [a, b)
+        for s, e, new_paragraph, p_words in zip(sent_starts.tolist(), sent_ends.tolist(),
+                                                 sent_paragraph.tolist(), sent_para_words.tolist()):
+            n = e - s
+            if b > a and new_paragraph and (b - a) + p_words > chunk_words and p_words <= chunk_words:
+                # Start a fresh chunk rather than split a paragraph that fits in one
+                self._emit(starts, ends, a, b, out)
+                a = b
+            if b == a:
+                a, b = s, e
+            elif (b - a) + n <= chunk_words:
+                b = e
+            else:
+                self._emit(starts, ends, a, b, out)
+                a = s if new_paragraph or overlap <= 0 else max(a, b - overlap)
+                b = e
+
+        self._open_starts = starts[a:b]
+        self._open_ends = ends[a:b]
+        return out
+
+
+def chunk_spans(text: str, chunk_words: int, overlap_words: int) -> List[Span]:
+    """(start, end, id) spans of the chunks of a cleaned document"""
+    builder = ChunkBuilder(chunk_words, overlap_words)
+    return builder.feed(text) + builder.close()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import hashlib
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from .chunking import PARAGRAPH_BREAK, PAGE_BREAK
+
+_DIGITS = re.compile(r"\d+")
+_WORD = re.compile(r"\w+")
+# Tokens that carry facts a near-duplicate must share: amounts, dates, clause numbers,
+# identifiers, and capitalised labels such as the letter in "Plan B"
+_FACT = re.compile(r"\b(?:\w*\d\w*|[A-Z][A-Z0-9]*)\b")
+_EDGE_PARAGRAPHS = 2  # Headers and footers are among the first / last paragraphs of a page
+_SHORT_PARAGRAPH_WORDS = 12
+_SHINGLE_WORDS = 3
+_MINHASH_BLOCK = 1 << 16  # Shingles hashed per block, bounding the (permutations, shingles) matrix
+
+
+def _paragraph_key(paragraph: str) -> str:
+    words = paragraph.lower().split()
+    key = " ".join(words)
+    # Page numbers and dates change from page to page in a short header line; in body
+    # text the numbers are what tells paragraphs apart
+    return _DIGITS.sub("#", key) if len(words) <= _SHORT_PARAGRAPH_WORDS else key
+
+
+def _edge_keys(paragraphs: List[str]) -> List[str]:
+    """Keys of the paragraphs where headers and footers sit, indexed like `paragraphs`"""
+    n = len(paragraphs)
+    return [_paragraph_key(p) if i < _EDGE_PARAGRAPHS or i >= n - _EDGE_PARAGRAPHS else ""
+            for i, p in enumerate(paragraphs)]
+
+
+class BoilerplateFilter:
+    """Strips running headers, footers and disclaimers from cleaned pages as they stream in.
+
+    A paragraph among the first or last two of a page is boilerplate if it recurs there
+    on at least `min_fraction` of the first `sample_pages` pages, and on at least
+    `min_pages` of them. Digits are ignored in short paragraphs such as "Page 3 of 40".
+    Its first occurrence is kept, so a CIN / UIN line can still be retrieved once, and
+    later copies are dropped. Pages are held back only while the sample is collected.
+    """
+
+    def __init__(self, sample_pages: int, min_fraction: float, min_pages: int):
+        self.sample_pages = sample_pages
+        self.min_fraction = min_fraction
+        self.min_pages = min_pages
+        self._sample: List[str] = []
+        self._boilerplate: Set[str] = set()
+        self._seen: Set[str] = set()
+        self._decided = False
+        self.removed = 0  # Paragraphs dropped so far
+
+    def feed(self, page: str) -> List[str]:
+        """Add the next page; returns the pages now ready to chunk, boilerplate removed"""
+        if self._decided:
+            return [self._strip(page)]
+        self._sample.append(page)
+        return self._decide() if len(self._sample) >= self.sample_pages else []
+
+    def close(self) -> List[str]:
+        return [] if self._decided else self._decide()
+
+    def _decide(self) -> List[str]:
+        counts: Counter = Counter()
+        for page in self._sample:
+            counts.update(set(_edge_keys(page.split(PARAGRAPH_BREAK))))
+        needed = max(self.min_pages, math.ceil(self.min_fraction * len(self._sample)))
+        self._boilerplate = {key for key, n in counts.items() if n >= needed and key}
+        self._decided = True
+        pages = [self._strip(page) for page in self._sample]
+        self._sample = []
+        return pages
+
+    def _strip(self, page: str) -> str:
+        if not self._boilerplate:
+            return page
+        kept = []
+        paragraphs = page.split(PARAGRAPH_BREAK)
+        for paragraph, key in zip(paragraphs, _edge_keys(paragraphs)):
+            if key in self._boilerplate:
+                if key in self._seen:
+                    self.removed += 1
+                    continue
+                self._seen.add(key)
+            kept.append(paragraph)
+        return PARAGRAPH_BREAK.join(kept)
+
+
+def strip_boilerplate(text: str, sample_pages: int, min_fraction: float, min_pages: int) -> str:
+    """BoilerplateFilter over a whole document whose pages are joined by PAGE_BREAK"""
+    f = BoilerplateFilter(sample_pages, min_fraction, min_pages)
+    pages: List[str] = []
+    for page in text.split(PAGE_BREAK):
+        pages += f.feed(page)
+    pages += f.close()
+    return PAGE_BREAK.join(p for p in pages if p)
+
+
+def _fact_digest(text: str) -> bytes:
+    return hashlib.blake2b("\0".join(_FACT.findall(text)).encode("utf-8", errors="surrogatepass"),
+                           digest_size=16).digest()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """64-bit hashes of the text's overlapping word 3-grams"""
+    # crc32 rather than hash(), which is salted per process, so results are reproducible
+    words = np.array([zlib.crc32(w.encode("utf-8", errors="surrogatepass")) for w in _WORD.findall(text.lower())] or [0], dtype=np.uint64)
+    if len(words) < _SHINGLE_WORDS:
+        return words
+    h = words[:1 - _SHINGLE_WORDS].copy()
+    for i in range(1, _SHINGLE_WORDS):
+        h *= np.uint64(0x9E3779B97F4A7C15)
+        h ^= words[i:len(words) - _SHINGLE_WORDS + 1 + i]
+    return h
+
+
+class DuplicateFilter:
+    """Drops chunks that repeat an earlier chunk exactly or nearly.
+
+    Exact repeats (case and whitespace ignored) are caught by hash. Near repeats are
+    found with MinHash signatures of word 3-grams. LSH buckets (`bands` bands over
+    the signature) give candidates, and a candidate counts as a duplicate when its
+    estimated Jaccard similarity reaches `threshold` and both have the same numbers,
+    identifiers and capitalised labels, so plan variants that differ only in a sum
+    insured or a plan letter are all kept. State carries across keep() calls,
+    so chunks can be filtered batch by batch as a document streams in.
+    """
+
+    def __init__(self, threshold: float, permutations: int, bands: int, seed: int = 0):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: (a * x + b) >> 32 with odd a, one (a, b) pair per permutation
+        self._a = (rng.integers(0, 1 << 63, size=(self.rows * bands, 1), dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=(self.rows * bands, 1), dtype=np.uint64)
+        self._exact: Set[bytes] = set()
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+        self._facts: List[bytes] = []
+        self.removed = 0
+
+    def _signatures_of(self, texts: List[str]) -> np.ndarray:
+        shingles = [_shingle_hashes(t) for t in texts]
+        out = np.empty((len(texts), len(self._a)), dtype=np.uint64)
+        i = 0
+        while i < len(texts):
+            # Group texts until the block holds about _MINHASH_BLOCK shingles
+            j, total = i, 0
+            while j < len(texts) and (j == i or total + len(shingles[j]) <= _MINHASH_BLOCK):
+                total += len(shingles[j])
+                j += 1
+            block = np.concatenate(shingles[i:j])
+            starts = np.cumsum([0] + [len(s) for s in shingles[i:j - 1]])
+            values = (self._a * block + self._b) >> np.uint64(32)
+            out[i:j] = np.minimum.reduceat(values, starts, axis=1).T
+            i = j
+        return out
+
+    def keep(self, texts: List[str]) -> List[bool]:
+        """Per text, False if it duplicates an earlier text (from this or a previous call)"""
+        if not texts:
+            return []
+        signatures = self._signatures_of(texts)
+        result = []
+        for text, signature in zip(texts, signatures):
+            digest = hashlib.blake2b(" ".join(text.lower().split()).encode("utf-8", errors="surrogatepass"),
+                                     digest_size=16).digest()
+            duplicate = digest in self._exact
+            keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+            facts = _fact_digest(text)
+            if not duplicate:
+                candidates = {c for key in keys for c in self._buckets.get(key, ())}
+                duplicate = any(self._facts[c] == facts and np.mean(self._signatures[c] == signature) >= self.threshold
+                                for c in candidates)
+            if duplicate:
+                self.removed += 1
+            else:
+                self._exact.add(digest)
+                for key in keys:
+                    self._buckets.setdefault(key, []).append(len(self._signatures))
+                self._signatures.append(signature)
+                self._facts.append(facts)
+            result.append(not duplicate)
+        return result
@@ -0,0 +1,40 @@
+from __future__ import annotations
+import os
+import threading
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process, or 0 where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RssTracker:
+    """Peak process RSS observed while one document is in flight.
+
+    Other documents processed concurrently share the process, so the figure is
+    an upper bound on what this document alone needed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.start_bytes = current_rss_bytes()
+        self.peak_bytes = self.start_bytes
+
+    def sample(self) -> None:
+        rss = current_rss_bytes()
+        with self._lock:
+            if rss > self.peak_bytes:
+                self.peak_bytes = rss
+
+    @property
+    def peak_delta_bytes(self) -> int:
+        return max(0, self.peak_bytes - self.start_bytes)
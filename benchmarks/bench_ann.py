@@ -0,0 +1,48 @@
+"""IVF approximate search vs exact search for large documents.
+
+Run from the repo root:  python -m benchmarks.bench_ann
+Uses clustered synthetic unit vectors. Recall@k is measured against exact search.
+"""
+from __future__ import annotations
+import time
+
+import numpy as np
+
+from app.config import TOP_K
+from app.services.ann import IVFIndex, default_list_count
+from benchmarks.timing import best_of
+
+DIM = 1536
+N_TOPICS = 2000
+N_QUERIES = 20
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((N_TOPICS, DIM), dtype=np.float32)
+    print(f"{'chunks':>8} {'lists':>6} {'nprobe':>6} {'build s':>8} {'exact ms/q':>10} {'ivf ms/q':>9} {'recall':>7}")
+    for n in (20_000, 50_000, 100_000):
+        x = _unit(topics[rng.integers(0, N_TOPICS, n)] + 0.7 * rng.standard_normal((n, DIM), dtype=np.float32))
+        q = _unit(x[rng.choice(n, N_QUERIES, replace=False)] + 0.05 * rng.standard_normal((N_QUERIES, DIM), dtype=np.float32))
+        sims = q @ x.T
+        truth = np.argsort(-sims, axis=1)[:, :TOP_K]
+        exact_s = best_of(lambda: [np.argpartition(-(x @ v), TOP_K)[:TOP_K] for v in q])
+
+        start = time.perf_counter()
+        index = IVFIndex(x, default_list_count(n), 1)
+        build_s = time.perf_counter() - start
+        for n_probe in (8, 16, 32, 64):
+            index.n_probe = n_probe
+            found, _ = index.search(q, TOP_K)
+            recall = sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / truth.size
+            ivf_s = best_of(lambda: index.search(q, TOP_K))
+            print(f"{n:>8} {len(index.centroids):>6} {n_probe:>6} {build_s:>8.2f} {exact_s / N_QUERIES * 1e3:>10.2f} "
+                  f"{ivf_s / N_QUERIES * 1e3:>9.3f} {recall:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
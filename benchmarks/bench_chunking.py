@@ -0,0 +1,66 @@
+"""clean_text and chunking throughput on multi-megabyte documents.
+
+Run from the repo root:  python -m benchmarks.bench_chunking
+Uses synthetic pages of paragraphs and sentences. "one-shot" chunks the whole text
+with chunk_spans; "per page" feeds a ChunkBuilder page by page, as the ingestion
+pipeline does.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+from app.config import DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS
+from app.utils.chunking import ChunkBuilder, PAGE_BREAK, chunk_spans, clean_text
+from benchmarks.timing import best_of
+
+WORDS = ["policy", "insured", "premium", "claim", "hospital", "coverage", "period", "benefit",
+         "waiting", "treatment", "sum", "the", "of", "and", "is", "for", "under", "any"]
+PAGE_CHARS = 3000
+
+
+def _pages(size: int, rng: np.random.Generator) -> list:
+    """Raw page texts (line-wrapped paragraphs) totalling about `size` characters"""
+    pages = []
+    total = 0
+    while total < size:
+        paragraphs = []
+        length = 0
+        while length < PAGE_CHARS:
+            sentences = []
+            for _ in range(rng.integers(1, 12)):
+                words = [WORDS[i] for i in rng.integers(0, len(WORDS), rng.integers(5, 30))]
+                sentences.append(words[0].capitalize() + " " + " ".join(words[1:]) + ".")
+            paragraph = " ".join(sentences)
+            # Wrap lines the way extracted PDF text is wrapped
+            paragraph = "\n".join(paragraph[i:i + 80] for i in range(0, len(paragraph), 80))
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        pages.append("\n\n".join(paragraphs))
+        total += length
+    return pages
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'MB':>4} {'chunks':>7} {'clean s':>8} {'one-shot s':>10} {'per page s':>10} {'MB/s':>6}")
+    for mb in (1, 4, 16):
+        raw = _pages(mb * 1_000_000, rng)
+        pages = [clean_text(p) for p in raw]
+        text = PAGE_BREAK.join(pages)
+        clean_s = best_of(lambda: clean_text(PAGE_BREAK.join(raw)))
+        spans = chunk_spans(text, DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS)
+        one_shot_s = best_of(lambda: chunk_spans(text, DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS))
+
+        def per_page() -> None:
+            builder = ChunkBuilder(DEFAULT_CHUNK_WORDS, DEFAULT_CHUNK_OVERLAP_WORDS)
+            for page in pages:
+                builder.feed(page)
+            builder.close()
+
+        per_page_s = best_of(per_page)
+        print(f"{mb:>4} {len(spans):>7} {clean_s:>8.3f} {one_shot_s:>10.3f} {per_page_s:>10.3f} "
+              f"{len(text) / 1e6 / one_shot_s:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Recall vs speed vs memory for reduced-dimension and quantized Retriever storage.
+
+Run from the repo root:  python -m benchmarks.bench_quantization [embeddings.npy]
+
+With a path, chunk vectors are loaded from it. For example, dump `retriever.embeddings`
+for an ingested policy with np.save. Without one, synthetic vectors are used instead,
+with variance decaying across dimensions like text-embedding-3 output. Either way, the
+queries are noisy copies of random chunks.
+
+Shorter widths are made the way the API's `dimensions` parameter does it: keep the
+leading components and re-normalise. Recall@k is measured against exact float32
+search at full width.
+"""
+from __future__ import annotations
+import sys
+
+import numpy as np
+
+from app.config import TOP_K
+from app.services import retrieval
+from app.services.retrieval import Chunk, Retriever
+from benchmarks.timing import best_of
+
+N_SYNTHETIC = 20_000
+N_TOPICS = 400
+N_QUERIES = 20
+DIMS = (1536, 512, 256)
+STORAGES = ("float32", "float16", "int8")
+
+
+def _synthetic(rng: np.random.Generator, n: int, dim: int = 1536) -> np.ndarray:
+    # Chunks cluster around topics, so near neighbours are meaningful
+    decay = 1.0 / np.sqrt(1.0 + np.arange(dim, dtype=np.float32) / 32.0)
+    topics = rng.standard_normal((N_TOPICS, dim), dtype=np.float32)
+    x = topics[rng.integers(0, N_TOPICS, n)] + 0.7 * rng.standard_normal((n, dim), dtype=np.float32)
+    return x * decay
+
+
+def _truncate(x: np.ndarray, dim: int) -> np.ndarray:
+    t = np.ascontiguousarray(x[:, :dim])
+    return t / (np.linalg.norm(t, axis=1, keepdims=True) + 1e-12)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main() -> None:
+    # Compare raw rankings; the similarity threshold would blank out hits on synthetic data
+    retrieval.CHUNK_SIMILARITY_THRESHOLD = -1.0
+    rng = np.random.default_rng(0)
+    base = np.load(sys.argv[1]).astype(np.float32) if len(sys.argv) > 1 else _synthetic(rng, N_SYNTHETIC)
+    base /= np.linalg.norm(base, axis=1, keepdims=True) + 1e-12
+    picks = rng.choice(len(base), N_QUERIES, replace=False)
+    queries = base[picks] + 0.05 * rng.standard_normal((N_QUERIES, base.shape[1]), dtype=np.float32)
+    chunks = [Chunk.from_text(i, "") for i in range(len(base))]
+
+    truth = Retriever(base, chunks, storage="float32")
+    truth_idx = truth.search_batch(queries, TOP_K)[0]
+
+    print(f"{len(base)} chunks, {N_QUERIES} queries, recall@{TOP_K} vs float32/{base.shape[1]}")
+    print(f"{'dims':>6} {'storage':>8} {'index MB':>9} {'x smaller':>9} {'batch ms':>9} {'recall':>7}")
+    full_bytes = truth.nbytes
+    for dim in DIMS:
+        if dim > base.shape[1]:
+            continue
+        q = _truncate(queries, dim)
+        for storage in STORAGES:
+            retriever = Retriever(_truncate(base, dim), chunks, storage=storage)
+            elapsed = best_of(lambda: retriever.search_batch(q, TOP_K))
+            found = retriever.search_batch(q, TOP_K)[0]
+            print(f"{dim:>6} {storage:>8} {retriever.nbytes / 2**20:>9.1f} {full_bytes / retriever.nbytes:>8.1f}x "
+                  f"{elapsed * 1e3:>9.1f} {_recall(found, truth_idx):>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
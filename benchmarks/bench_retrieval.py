@@ -0,0 +1,32 @@
+"""Retriever.search_batch vs a per-query Retriever.search loop.
+
+Run from the repo root:  python -m benchmarks.bench_retrieval
+Uses random unit vectors, so only the timings are meaningful.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+from app.config import TOP_K
+from app.services.retrieval import Chunk, Retriever
+from benchmarks.timing import best_of
+
+DIM = 1536
+N_QUERIES = 20
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'loop ms':>10} {'batch ms':>10} {'speedup':>8}")
+    for n in (1_000, 10_000, 100_000):
+        embeddings = rng.standard_normal((n, DIM), dtype=np.float32)
+        retriever = Retriever(embeddings, [Chunk.from_text(i, "") for i in range(n)])
+        queries = rng.standard_normal((N_QUERIES, DIM), dtype=np.float32)
+
+        loop_s = best_of(lambda: [retriever.search(q, TOP_K) for q in queries])
+        batch_s = best_of(lambda: retriever.search_batch(queries, TOP_K))
+        print(f"{n:>8} {loop_s * 1e3:>10.1f} {batch_s * 1e3:>10.1f} {loop_s / batch_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
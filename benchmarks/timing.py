@@ -0,0 +1,14 @@
+"""Timing helpers shared by the benchmark scripts."""
+from __future__ import annotations
+import time
+from typing import Callable
+
+
+def best_of(fn: Callable[[], object], repeats: int = 3) -> float:
+    """Fastest of `repeats` runs of fn, in seconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
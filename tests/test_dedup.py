@@ -0,0 +1,25 @@
+from app.utils.dedup import DuplicateFilter
+
+PLAN = ("Plan {plan} of the Easy Health policy covers in-patient hospitalisation, day care procedures, "
+        "pre and post hospitalisation expenses for 60 and 180 days, ambulance charges and domiciliary "
+        "treatment. The sum insured under Plan {plan} is Rs {amount} lakh per policy year, available on an "
+        "individual or floater basis. Room rent is payable up to the single private room category and "
+        "ICU charges are payable in full. Cumulative bonus of ten percent of the sum insured is added for "
+        "every claim free year up to a maximum of one hundred percent. Pre-existing diseases are covered "
+        "after a waiting period of thirty six months of continuous coverage with the company. Co-payment "
+        "applies to insured persons aged above sixty one years at entry.")
+
+
+def _filter() -> DuplicateFilter:
+    return DuplicateFilter(threshold=0.9, permutations=64, bands=16)
+
+
+def test_plan_variants_with_different_amounts_are_kept():
+    texts = [PLAN.format(plan=p, amount=a) for p, a in (("A", 5), ("B", 10), ("C", 25))]
+    assert _filter().keep(texts) == [True, True, True]
+
+
+def test_near_duplicates_with_the_same_facts_are_dropped():
+    text = PLAN.format(plan="A", amount=5)
+    reworded = text.replace("available on an individual", "offered on an individual")
+    assert _filter().keep([text, reworded, text.upper().lower()]) == [True, False, False]